@@ -0,0 +1,417 @@
+# archive.py
+import asyncio
+import math
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from history import pick_tier, ROLLUP_TIERS, ROLLUP_AGGS
+
+# Carpeta del archivo en disco: un subdirectorio por IP y un fichero por métrica
+ARCHIVE_DIR = os.environ.get(
+    "METRIC_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive")
+)
+
+# Niveles de consolidación de los ficheros nuevos: (segundos por fila,
+# filas), con la retención de ROLLUP_TIERS
+ARCHIVE_TIERS = tuple((step, retention // step) for step, retention in ROLLUP_TIERS)
+
+# Series abiertas a la vez; cada una ocupa un descriptor de fichero. Sin
+# ARCHIVE_MAX_OPEN, start() lo ajusta al límite de descriptores del proceso
+ARCHIVE_MAX_OPEN = int(os.environ.get("ARCHIVE_MAX_OPEN", 0)) or None
+# Descriptores que se dejan libres para sockets, SQLite, etc.
+ARCHIVE_RESERVED_FDS = 1024
+# Cada serie abierta también es un mapping; se usa como mucho esta parte de
+# vm.max_map_count (el resto es para librerías y el reservador de memoria)
+ARCHIVE_MAP_SHARE = 0.5
+# Cada cuánto escribe el escritor en segundo plano y cuántos sondeos encola
+ARCHIVE_FLUSH_S = 1.0
+ARCHIVE_QUEUE_MAX = 50_000
+
+MAGIC = b"SNMPRRD3"
+MAX_TIERS = 8
+HEADER_SIZE = 256
+EMPTY = -1
+
+HEADER = np.dtype([
+    ("magic", "S8"),
+    ("tiers", "<u4"),
+    ("reserved", "<u4"),
+    ("step", "<u4", (MAX_TIERS,)),
+    ("rows", "<u4", (MAX_TIERS,)),
+    ("last", "<i8", (MAX_TIERS,)),  # último intervalo escrito (timestamp // step)
+])
+
+ROW = np.dtype([
+    ("start", "<f8"),  # inicio del intervalo (epoch)
+    ("count", "<f8"),  # muestras consolidadas
+    ("min", "<f8"),    # el resto son NaN si no hubo muestras
+    ("avg", "<f8"),
+    ("max", "<f8"),
+    ("last", "<f8"),
+    ("last_ts", "<f8"),  # timestamp de `last`, para no pisarlo con muestras atrasadas
+])
+
+
+class MetricSeries:
+    """
+    Una serie (dispositivo, métrica) en un fichero de tamaño fijo al estilo
+    RRD, mapeado en memoria. Tras la cabecera van los niveles de
+    consolidación, cada uno un buffer circular de `rows` intervalos con el
+    mínimo, la media, el máximo y el último valor de cada uno.
+
+    Como en el histórico en memoria, cada fila se escribe dos veces (en i y
+    en i + rows), así los últimos `rows` intervalos siempre están contiguos
+    y window() devuelve vistas del mmap sin copiar. Las escrituras
+    actualizan la fila en su sitio; el sistema operativo las lleva a disco.
+
+    Los niveles se leen de la cabecera, de modo que cambiar ARCHIVE_TIERS
+    solo afecta a los ficheros nuevos.
+    """
+
+    def __init__(self, path: str, tiers: tuple[tuple[int, int], ...] = ARCHIVE_TIERS):
+        if not os.path.exists(path):
+            self._create(path, tiers)
+
+        with open(path, "r+b") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0)
+        self.path = path
+        if len(self._mmap) < HEADER_SIZE:
+            self.close()
+            raise ValueError(f"{path} está truncado")
+        self._header = np.ndarray((), HEADER, buffer=self._mmap)
+        count = int(self._header["tiers"])
+        if bytes(self._header["magic"]) != MAGIC or not 0 < count <= MAX_TIERS:
+            self.close()
+            raise ValueError(f"{path} no es un archivo de métricas")
+
+        self.tiers = tuple(
+            (int(step), int(rows))
+            for step, rows in zip(self._header["step"][:count], self._header["rows"][:count])
+        )
+        if len(self._mmap) < HEADER_SIZE + sum(2 * rows for _, rows in self.tiers) * ROW.itemsize:
+            self.close()
+            raise ValueError(f"{path} está truncado")
+        self._archives = []
+        offset = HEADER_SIZE
+        for _, rows in self.tiers:
+            self._archives.append(
+                np.ndarray((2 * rows,), ROW, buffer=self._mmap, offset=offset)
+            )
+            offset += 2 * rows * ROW.itemsize
+
+    @staticmethod
+    def _create(path: str, tiers: tuple[tuple[int, int], ...]):
+        if len(tiers) > MAX_TIERS:
+            raise ValueError(f"Como máximo {MAX_TIERS} niveles de consolidación")
+
+        header = np.zeros((), HEADER)
+        header["magic"] = MAGIC
+        header["tiers"] = len(tiers)
+        header["last"] = EMPTY
+        for k, (step, rows) in enumerate(tiers):
+            header["step"][k] = step
+            header["rows"][k] = rows
+
+        size = HEADER_SIZE + sum(2 * rows for _, rows in tiers) * ROW.itemsize
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Se escribe en un temporal y se renombra para no dejar ficheros a medias
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header.tobytes())
+            f.truncate(size)
+        os.replace(tmp, path)
+
+    def _advance(self, k: int, bucket: int):
+        """Abre los intervalos hasta `bucket` (vacíos) en el nivel k."""
+        step, rows = self.tiers[k]
+        last = int(self._header["last"][k])
+        first = bucket - rows + 1 if last == EMPTY else max(last + 1, bucket - rows + 1)
+
+        buckets = np.arange(first, bucket + 1)
+        archive = self._archives[k]
+        for index in (buckets % rows, buckets % rows + rows):
+            archive["start"][index] = buckets * step
+            archive["count"][index] = 0
+            for agg in (*ROLLUP_AGGS, "last_ts"):
+                archive[agg][index] = np.nan
+        self._header["last"][k] = bucket
+
+    def update(self, timestamp: float, value: float):
+        """Consolida una muestra en todos los niveles."""
+        if math.isnan(value):
+            return
+        for k, (step, rows) in enumerate(self.tiers):
+            bucket = int(timestamp // step)
+            last = int(self._header["last"][k])
+            if last == EMPTY or bucket > last:
+                self._advance(k, bucket)
+            elif bucket <= last - rows:
+                continue  # más antigua que lo que guarda este nivel
+
+            i = bucket % rows
+            row = self._archives[k][i]
+            count = row["count"] + 1
+            last, last_ts = value, timestamp
+            if count == 1:
+                low = avg = high = value
+            else:
+                low = min(row["min"], value)
+                avg = row["avg"] + (value - row["avg"]) / count
+                high = max(row["max"], value)
+                if timestamp < row["last_ts"]:
+                    last, last_ts = row["last"], row["last_ts"]
+            for pos in (i, i + rows):
+                self._archives[k][pos] = (row["start"], count, low, avg, high, last, last_ts)
+
+    def window(
+        self,
+        step: int,
+        since: float | None = None,
+        until: float | None = None,
+        agg: str = "avg",
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (inicio de intervalo, `agg`) del nivel de `step` segundos para los
+        intervalos que empiezan entre `since` y `until`. Son vistas del mmap:
+        hay que usarlas (o copiarlas) antes de volver al bucle de eventos.
+        """
+        k = self.tier_index(step)
+        rows = self.tiers[k][1]
+        archive = self._archives[k]
+        last = int(self._header["last"][k])
+        if last == EMPTY:
+            return archive["start"][:0], archive[agg][:0]
+
+        first = last - rows + 1
+        lo = first if since is None else max(first, math.ceil(since / step))
+        hi = last if until is None else min(last, math.floor(until / step))
+        hi = max(hi, lo - 1)
+
+        offset = first % rows - first
+        return (
+            archive["start"][lo + offset:hi + offset + 1],
+            archive[agg][lo + offset:hi + offset + 1],
+        )
+
+    def tier_index(self, step: int) -> int:
+        for k, (tier_step, _) in enumerate(self.tiers):
+            if tier_step == step:
+                return k
+        raise ValueError(f"No hay nivel de {step} s en {self.path}")
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        # Sin msync: las páginas del mapping compartido ya son del fichero
+        # y el sistema las escribe igual tras cerrarlo
+        self._header = None
+        self._archives = []
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Alguien conserva una vista; el mmap se cierra al liberarla
+            pass
+
+
+def max_map_count() -> int | None:
+    # Límite de mappings por proceso en Linux; None si no se puede leer
+    try:
+        with open("/proc/sys/vm/max_map_count") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def open_files_limit() -> int:
+    """
+    Series que se pueden tener abiertas: sube el límite blando de
+    descriptores hasta el duro y deja ARCHIVE_RESERVED_FDS libres, sin
+    pasar de ARCHIVE_MAP_SHARE de vm.max_map_count (con más mappings los
+    mmap fallan con ENOMEM antes de agotar los descriptores).
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 512
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 65536 if hard == resource.RLIM_INFINITY else min(hard, 65536)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+            soft = wanted
+        except (ValueError, OSError):
+            pass
+    limit = soft - ARCHIVE_RESERVED_FDS
+    maps = max_map_count()
+    if maps is not None:
+        limit = min(limit, int(maps * ARCHIVE_MAP_SHARE))
+    return max(limit, 64)
+
+
+class MetricArchive:
+    """
+    Archivo en disco de todas las series, una por (IP, métrica). Lo
+    alimenta get_snmp_snapshot con las métricas de cada sondeo real, igual
+    que al histórico en memoria, y sobrevive a los reinicios.
+
+    Como en SqliteHistory, append() solo encola el sondeo; un escritor en
+    segundo plano lo consolida cada ARCHIVE_FLUSH_S desde un hilo
+    (asyncio.to_thread), así abrir o crear ficheros nunca bloquea el bucle
+    de eventos. Sin start() (scripts, pruebas) append() escribe directamente.
+
+    Mantiene abiertas las `max_open` series usadas más recientemente; por
+    defecto, tantas como permita el límite de descriptores, para que una
+    flota de miles de dispositivos no tenga que reabrir ficheros en cada
+    sondeo. Pensado para un único proceso escritor.
+    """
+
+    def __init__(
+        self,
+        directory: str = ARCHIVE_DIR,
+        tiers: tuple[tuple[int, int], ...] = ARCHIVE_TIERS,
+        max_open: int | None = ARCHIVE_MAX_OPEN,
+    ):
+        self.directory = directory
+        self.tiers = tiers
+        self.max_open = max_open or 512
+        self._auto_max_open = max_open is None
+        self._open: OrderedDict[tuple[str, str], MetricSeries] = OrderedDict()
+        # El escritor (un hilo) y las lecturas (el bucle) comparten las series
+        self._lock = threading.Lock()
+        self._queue: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+        self._stats = {"written": 0, "dropped": 0, "errors": 0}
+
+    def _path(self, ip: str, metric: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", ip), f"{metric}.rrd")
+
+    def _series(self, ip: str, metric: str, create: bool = False) -> MetricSeries | None:
+        # Con self._lock tomado
+        key = (ip, metric)
+        series = self._open.get(key)
+        if series is not None:
+            self._open.move_to_end(key)
+            return series
+
+        path = self._path(ip, metric)
+        if not create and not os.path.exists(path):
+            return None
+        try:
+            series = MetricSeries(path, self.tiers)
+        except ValueError:
+            # Formato antiguo, fichero truncado o dañado: se aparta y se empieza otro
+            os.replace(path, f"{path}.old")
+            series = MetricSeries(path, self.tiers)
+        self._open[key] = series
+        while len(self._open) > self.max_open:
+            _, oldest = self._open.popitem(last=False)
+            oldest.close()
+        return series
+
+    async def start(self):
+        if self._writer is not None:
+            return
+        if self._auto_max_open:
+            self.max_open = open_files_limit()
+        self._queue = asyncio.Queue(maxsize=ARCHIVE_QUEUE_MAX)
+        self._stopping = asyncio.Event()
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Consolida lo que quede en la cola y cierra las series."""
+        if self._writer is not None:
+            self._stopping.set()
+            await self._writer
+            self._writer = None
+        await asyncio.to_thread(self.close)
+
+    def append(self, ip: str, timestamp: float, metrics: dict[str, float]):
+        if self._writer is None:
+            self._write([(ip, timestamp, metrics)])
+            return
+        try:
+            self._queue.put_nowait((ip, timestamp, metrics))
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), ARCHIVE_FLUSH_S)
+            except TimeoutError:
+                pass
+            batch = []
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch:
+                await asyncio.to_thread(self._write, batch)
+            if self._stopping.is_set():
+                return
+
+    def _write(self, batch: list[tuple[str, float, dict[str, float]]]):
+        for ip, timestamp, metrics in batch:
+            for metric, value in metrics.items():
+                # Por muestra, para no dejar las lecturas esperando a todo el
+                # lote; un fichero o un disco con problemas solo pierde esa
+                # muestra y el escritor sigue
+                try:
+                    with self._lock:
+                        self._series(ip, metric, create=True).update(timestamp, value)
+                except (OSError, ValueError):
+                    self._stats["errors"] += 1
+            self._stats["written"] += 1
+
+    def window(
+        self,
+        ip: str,
+        metric: str,
+        since: float | None = None,
+        until: float | None = None,
+        step: float | None = None,
+        agg: str = "avg",
+    ) -> tuple[int, np.ndarray, np.ndarray, np.ndarray] | None:
+        """
+        (segundos por intervalo, inicios, valores, muestras por intervalo)
+        del nivel más grueso que no supera `step` (el más fino si se pide
+        menos, el más grueso sin `step`); ver MetricSeries.window. None si
+        no hay archivo de la serie. Se copian con el lock tomado, así que
+        las tres series son del mismo momento aunque el escritor esté
+        actualizando el último intervalo.
+        """
+        with self._lock:
+            series = self._series(ip, metric)
+            if series is None:
+                return None
+            steps = [tier_step for tier_step, _ in series.tiers]
+            tier = max(steps) if step is None else pick_tier(steps, step) or min(steps)
+            starts, values = series.window(tier, since, until, agg)
+            _, counts = series.window(tier, since, until, "count")
+            return tier, starts.copy(), values.copy(), counts.copy()
+
+    def close(self):
+        with self._lock:
+            while self._open:
+                _, series = self._open.popitem()
+                series.flush()
+                series.close()
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "open": len(self._open),
+            "max_open": self.max_open,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self._stats,
+            "tiers": [{"step": step, "rows": rows} for step, rows in self.tiers],
+        }
+
+
+# Instancia global; snmp_query la alimenta y main.py la arranca y la para
+metric_archive = MetricArchive()
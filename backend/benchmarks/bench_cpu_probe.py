@@ -0,0 +1,85 @@
+# bench_cpu_probe.py
+#
+# Compara cuánto se tarda en encontrar los núcleos de un equipo:
+#   - secuencial: un GET por índice candidato, uno detrás de otro (como
+#     hacía get_cpu_info antes)
+#   - recorrido:  GETBULK/GETNEXT de hrProcessorTable
+#   - sondeo:     probe_processor_loads, ventanas de índices en paralelo
+#
+# Uso (desde backend/):
+#   python benchmarks/bench_cpu_probe.py 192.168.1.10 --community public --runs 5
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snmp_query import (  # noqa: E402
+    HR_PROCESSOR_LOAD,
+    build_auth_data,
+    get_many,
+    probe_processor_loads,
+    snmp_manager,
+    walk_columns,
+    is_missing,
+    is_timeout,
+)
+
+# Candidatos que se probaban uno a uno (CPU_INDEX_CANDIDATES del código antiguo)
+SEQUENTIAL_CANDIDATES = [196608] + list(range(1, 33))
+
+
+async def sequential(engine, community, target) -> int:
+    found = 0
+    for idx in SEQUENTIAL_CANDIDATES:
+        oid = f"{HR_PROCESSOR_LOAD}.{idx}"
+        result = await get_many(engine, community, target, {"load": oid})
+        # Como antes: vale cualquier respuesta que no sea error ni "No Such..."
+        entry = result.get("load")
+        if not is_missing(entry) and not is_timeout(entry):
+            found += 1
+    return found
+
+
+async def walk(engine, community, target) -> int:
+    rows, _ = await walk_columns(engine, community, target, {"load": HR_PROCESSOR_LOAD}, 25)
+    return len(rows["load"])
+
+
+async def probe(engine, community, target) -> int:
+    return len(await probe_processor_loads(engine, community, target))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ip")
+    parser.add_argument("--port", type=int, default=161)
+    parser.add_argument("--community", default="public")
+    parser.add_argument("--version", default="2c")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = snmp_manager.start()
+    target = await snmp_manager.get_target(args.ip, args.port)
+    community = build_auth_data(args.community, args.version)
+
+    for name, method in (("secuencial", sequential), ("recorrido", walk), ("sondeo", probe)):
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            cores = await method(engine, community, target)
+            times.append(time.perf_counter() - start)
+        print(
+            f"{name:<11} núcleos={cores:<4} "
+            f"mediana={statistics.median(times) * 1000:8.1f} ms  "
+            f"máx={max(times) * 1000:8.1f} ms"
+        )
+
+    snmp_manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+# bench_history_db.py
+#
+# Mide cuántas muestras por segundo escribe SqliteHistory con una flota
+# simulada (por defecto 1000 dispositivos con 5 métricas cada 10 s, es
+# decir 500 muestras/s) y cuánto cuesta append() en el camino de la
+# petición. Se encolan varios intervalos seguidos y se cronometra hasta
+# que el escritor en segundo plano los ha vaciado.
+#
+# Uso (desde backend/):
+#   python benchmarks/bench_history_db.py --devices 1000 --interval 10 --rounds 60
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import METRICS  # noqa: E402
+from history_db import SqliteHistory  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=60, help="Intervalos simulados")
+    parser.add_argument("--db", help="Fichero de la base (por defecto, uno temporal)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "history.db")
+    polls = args.devices * args.rounds
+    store = SqliteHistory(path, queue_max=polls)
+    await store.start()
+
+    ips = [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(args.devices)]
+    t0 = time.time()
+    append_time = 0.0
+    start = time.perf_counter()
+    for round_ in range(args.rounds):
+        timestamp = t0 + round_ * args.interval
+        for ip in ips:
+            metrics = {metric: random.uniform(0, 100) for metric in METRICS}
+            before = time.perf_counter()
+            store.append(ip, timestamp, metrics)
+            append_time += time.perf_counter() - before
+        # Deja correr al escritor como haría el bucle de eventos
+        await asyncio.sleep(0)
+    await store.stop()
+    elapsed = time.perf_counter() - start
+
+    stats = store.stats()
+    required = args.devices * len(METRICS) / args.interval
+    throughput = stats["written"] / elapsed
+    print(f"muestras escritas  {stats['written']} en {stats['batches']} lotes "
+          f"({stats['dropped']} descartadas, {stats['errors']} errores)")
+    print(f"tiempo             {elapsed:.2f} s para {args.rounds * args.interval / 60:.0f} min simulados")
+    print(f"rendimiento        {throughput:,.0f} muestras/s "
+          f"(necesarias {required:,.0f}/s, margen x{throughput / required:.0f})")
+    print(f"append()           {append_time / polls * 1e6:.2f} µs por sondeo")
+    print(f"tamaño de la base  {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
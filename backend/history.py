@@ -0,0 +1,286 @@
+# history.py
+import numpy as np
+
+# Métricas que se guardan de cada sondeo
+METRICS = ("cpu", "ram", "disk", "if_in_octets", "if_out_octets")
+
+# Muestras que se guardan por dispositivo (1 h a 3 s por sondeo). La
+# memoria por dispositivo es fija: 16 * HISTORY_CAPACITY * (1 + métricas)
+# bytes, unos 115 KB con los valores por defecto.
+HISTORY_CAPACITY = 1200
+
+# Niveles de agregación del histórico a largo plazo: (segundos por
+# intervalo, segundos que se conservan). Cada intervalo guarda el mínimo,
+# la media, el máximo y el último valor de sus muestras.
+ROLLUP_TIERS = (
+    (60, 86400),         # 1 min durante 1 día
+    (300, 7 * 86400),    # 5 min durante 1 semana
+    (3600, 90 * 86400),  # 1 h durante 90 días
+)
+ROLLUP_AGGS = ("min", "avg", "max", "last")
+
+
+def _number(entry: dict | None) -> float | None:
+    if not entry:
+        return None
+    try:
+        return float(entry.get("Valor", ""))
+    except ValueError:
+        return None
+
+
+def _counter(entry: dict | None) -> float | None:
+    # Solo un contador que el agente devolvió (entero sin signo); un
+    # timeout o un noSuch* no es una muestra
+    if not entry or not str(entry.get("Valor", "")).isdigit():
+        return None
+    return float(entry["Valor"])
+
+
+def _percent(used: float | None, size: float | None) -> float | None:
+    if used is None or not size:
+        return None
+    return used / size * 100
+
+
+def extract_metrics(data: dict[str, dict]) -> dict[str, float]:
+    """
+    Métricas numéricas de un sondeo (formato de get_snmp_data):
+    - cpu: media de hrProcessorLoad.* (%)
+    - ram / disk: porcentaje usado de ramStorage* / diskStorage*
+    - if_in_octets / if_out_octets: contadores de la interfaz elegida
+
+    Las que no se pueden calcular no aparecen, tampoco los contadores
+    que no llegaron a responder.
+    """
+    loads = [
+        value
+        for key, entry in data.items()
+        if key.startswith("hrProcessorLoad.")
+        and (value := _number(entry)) is not None
+    ]
+    metrics = {
+        "cpu": sum(loads) / len(loads) if loads else None,
+        "ram": _percent(_number(data.get("ramStorageUsed")), _number(data.get("ramStorageSize"))),
+        "disk": _percent(_number(data.get("diskStorageUsed")), _number(data.get("diskStorageSize"))),
+    }
+    for key, entry in data.items():
+        if key.startswith("ifInOctets."):
+            metrics["if_in_octets"] = _counter(entry)
+        elif key.startswith("ifOutOctets."):
+            metrics["if_out_octets"] = _counter(entry)
+    return {name: value for name, value in metrics.items() if value is not None}
+
+
+def pick_tier(steps, step: float | None) -> int | None:
+    """
+    El nivel más grueso de `steps` (segundos por intervalo) que no supera
+    la resolución pedida; None si hacen falta las muestras sin agregar.
+    """
+    if step is None:
+        return None
+    fitting = [tier for tier in steps if tier <= step]
+    return max(fitting) if fitting else None
+
+
+def bucketize(
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    step: float,
+    agg: str = "avg",
+    weights: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Agrupa una serie en intervalos de `step` segundos alineados con la
+    época (como los de ROLLUP_TIERS) y calcula `agg` de cada uno, todo con
+    operaciones de NumPy. Devuelve (inicio de intervalo, valor) de los
+    intervalos con datos.
+
+    Los timestamps deben estar ordenados y los NaN se ignoran. Si los
+    valores ya son medias, `weights` (muestras de cada una) pondera la media.
+    """
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+    if not len(values):
+        return timestamps, values
+
+    buckets = np.floor(timestamps / step).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+
+    if agg == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif agg == "max":
+        result = np.maximum.reduceat(values, starts)
+    elif agg == "last":
+        result = values[ends - 1]
+    elif weights is None:
+        result = np.add.reduceat(values, starts) / (ends - starts)
+    else:
+        weights = weights[valid]
+        result = np.add.reduceat(values * weights, starts) / np.add.reduceat(weights, starts)
+    return buckets[starts] * float(step), result
+
+
+def lttb(
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    points: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce una serie a `points` puntos con Largest-Triangle-Three-Buckets:
+    conserva el primero y el último y, de cada cubo intermedio, el punto
+    que forma el triángulo más grande con el elegido antes y la media del
+    cubo siguiente. Así se mantienen los picos, que una media borraría.
+
+    El bucle es por cubo (cada elección depende de la anterior); dentro de
+    cada cubo el cálculo es vectorial. La serie no debe tener NaN.
+    """
+    n = len(values)
+    if points < 3 or n <= points:
+        return timestamps, values
+
+    # Cubo i: [edges[i], edges[i + 1]); el siguiente del último es el punto final
+    edges = np.r_[np.linspace(1, n - 1, points - 1).astype(np.int64), n]
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2]
+        cx = timestamps[next_lo:next_hi].mean()
+        cy = values[next_lo:next_hi].mean()
+
+        ax, ay = timestamps[a], values[a]
+        areas = np.abs(
+            (ax - cx) * (values[lo:hi] - ay) - (ax - timestamps[lo:hi]) * (cy - ay)
+        )
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return timestamps[selected], values[selected]
+
+
+class DeviceHistory:
+    """
+    Buffer circular de tamaño fijo con las últimas `capacity` muestras de
+    un dispositivo: un array de timestamps y uno de valores con una
+    columna por métrica (NaN si esa métrica faltó en el sondeo).
+
+    Cada muestra se escribe dos veces, en i y en i + capacity, así las
+    últimas `capacity` muestras siempre están contiguas y window()
+    devuelve vistas de NumPy sin copiar, aunque el buffer haya dado la
+    vuelta. Añadir es O(1).
+    """
+
+    def __init__(self, capacity: int = HISTORY_CAPACITY, metrics: tuple[str, ...] = METRICS):
+        self.capacity = capacity
+        self.metrics = metrics
+        self._columns = {name: col for col, name in enumerate(metrics)}
+        self._timestamps = np.zeros(2 * capacity, dtype=np.float64)
+        self._values = np.full((2 * capacity, len(metrics)), np.nan, dtype=np.float64)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    @property
+    def nbytes(self) -> int:
+        return self._timestamps.nbytes + self._values.nbytes
+
+    def first_timestamp(self) -> float | None:
+        # La muestra más antigua que sigue en el buffer
+        if not self._count:
+            return None
+        return float(self._timestamps[self._count % self.capacity if self._count > self.capacity else 0])
+
+    def last_timestamp(self) -> float | None:
+        if not self._count:
+            return None
+        return float(self._timestamps[(self._count - 1) % self.capacity])
+
+    def append(self, timestamp: float, metrics: dict[str, float]):
+        row = np.full(len(self.metrics), np.nan)
+        for name, value in metrics.items():
+            col = self._columns.get(name)
+            if col is not None:
+                row[col] = value
+
+        i = self._count % self.capacity
+        for pos in (i, i + self.capacity):
+            self._timestamps[pos] = timestamp
+            self._values[pos] = row
+        self._count += 1
+
+    def window(
+        self,
+        metric: str,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (timestamps, valores) de `metric` entre `since` y `until`
+        (epoch, incluidos). Son vistas del buffer: se sobrescriben con
+        las muestras nuevas, así que hay que usarlas (o copiarlas) antes
+        de volver al bucle de eventos.
+        """
+        col = self._columns[metric]
+        start = self._count % self.capacity if self._count > self.capacity else 0
+        stop = start + len(self)
+
+        timestamps = self._timestamps[start:stop]
+        lo = 0 if since is None else int(np.searchsorted(timestamps, since, "left"))
+        hi = len(timestamps) if until is None else int(np.searchsorted(timestamps, until, "right"))
+        return timestamps[lo:hi], self._values[start + lo:start + hi, col]
+
+
+class HistoryStore:
+    """
+    Histórico en memoria de todos los dispositivos, por IP. Lo alimenta
+    get_snmp_snapshot con las métricas (extract_metrics) de cada sondeo
+    real, no con los servidos de caché.
+    """
+
+    def __init__(self, capacity: int = HISTORY_CAPACITY):
+        self.capacity = capacity
+        self._devices: dict[str, DeviceHistory] = {}
+
+    def append(self, ip: str, timestamp: float, metrics: dict[str, float]):
+        history = self._devices.get(ip)
+        if history is None:
+            history = self._devices[ip] = DeviceHistory(self.capacity)
+
+        # Las búsquedas por tiempo necesitan timestamps crecientes
+        last = history.last_timestamp()
+        if last is not None and timestamp <= last:
+            return
+        history.append(timestamp, metrics)
+
+    def window(
+        self,
+        ip: str,
+        metric: str,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        """Ver DeviceHistory.window; None si no hay histórico de `ip`."""
+        history = self._devices.get(ip)
+        if history is None:
+            return None
+        return history.window(metric, since, until)
+
+    def first_timestamp(self, ip: str) -> float | None:
+        """Muestra más antigua que queda en memoria de `ip`; None si no hay."""
+        history = self._devices.get(ip)
+        return None if history is None else history.first_timestamp()
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "capacity": self.capacity,
+            "bytes": sum(history.nbytes for history in self._devices.values()),
+        }
+
+
+# Instancia global; snmp_query la alimenta y main.py la consulta
+history_store = HistoryStore()
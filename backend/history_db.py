@@ -0,0 +1,269 @@
+# history_db.py
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from history import pick_tier, ROLLUP_TIERS, ROLLUP_AGGS
+
+# Base de datos opcional del histórico; sin HISTORY_DB no se guarda nada
+HISTORY_DB = os.environ.get("HISTORY_DB") or None
+
+# Sondeos en cola como máximo; si el disco no da abasto se descartan
+HISTORY_DB_QUEUE_MAX = 50_000
+# Cada cuánto se escribe un lote y cuántas muestras caben en él
+HISTORY_DB_FLUSH_S = 1.0
+HISTORY_DB_BATCH_MAX = 20_000
+# Segundos que se guardan las muestras sin agregar (los agregados, los de
+# ROLLUP_TIERS) y cada cuánto se borra lo caducado
+HISTORY_DB_RAW_RETENTION_S = 86400
+HISTORY_DB_PRUNE_S = 300
+
+INSERT_SAMPLE = (
+    "INSERT OR REPLACE INTO samples (ip, metric, ts, value) VALUES (?, ?, ?, ?)"
+)
+# Agregado incremental: en el UPDATE las columnas son las de antes de la
+# muestra, así que la media usa el count anterior
+UPSERT_ROLLUP = """
+    INSERT INTO rollups (ip, metric, step, start, count, min, avg, max, last, last_ts)
+    VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+    ON CONFLICT (ip, metric, step, start) DO UPDATE SET
+        count = count + 1,
+        min = min(min, excluded.min),
+        avg = avg + (excluded.avg - avg) / (count + 1),
+        max = max(max, excluded.max),
+        last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+        last_ts = max(last_ts, excluded.last_ts)
+"""
+
+
+class SqliteHistory:
+    """
+    Histórico opcional en SQLite, para quien quiera consultarlo con SQL.
+
+    append() solo encola el sondeo (nunca bloquea al llamante; con la cola
+    llena lo descarta y lo cuenta). Una tarea en segundo plano junta lo
+    encolado cada HISTORY_DB_FLUSH_S y lo escribe en una sola transacción
+    con executemany, que reutiliza la misma sentencia preparada, desde un
+    hilo (asyncio.to_thread). La base va en modo WAL, así las lecturas no
+    esperan a las escrituras.
+
+    En la misma transacción cada muestra se suma a sus intervalos de
+    ROLLUP_TIERS (mínimo, media, máximo y último), así los agregados están
+    al día sin recalcular nada. Cada HISTORY_DB_PRUNE_S se borran las
+    muestras y agregados más antiguos que la retención de su nivel.
+
+    Tablas:
+    - samples(ip, metric, ts, value), clave (ip, metric, ts)
+    - rollups(ip, metric, step, start, count, min, avg, max, last, last_ts),
+      clave (ip, metric, step, start)
+    """
+
+    def __init__(self, path: str | None = HISTORY_DB, queue_max: int = HISTORY_DB_QUEUE_MAX):
+        self.path = path
+        self.queue_max = queue_max
+        self._queue: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+        self._write_conn: sqlite3.Connection | None = None
+        self._read_conn: sqlite3.Connection | None = None
+        self._read_lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._stats = {"written": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # En WAL basta NORMAL: un corte de luz puede perder el último lote,
+        # pero no corrompe la base
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _open(self):
+        self._write_conn = self._connect()
+        self._write_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                ip TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                ts REAL NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (ip, metric, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        self._write_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollups (
+                ip TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                step INTEGER NOT NULL,
+                start REAL NOT NULL,
+                count INTEGER NOT NULL,
+                min REAL NOT NULL,
+                avg REAL NOT NULL,
+                max REAL NOT NULL,
+                last REAL NOT NULL,
+                last_ts REAL NOT NULL,
+                PRIMARY KEY (ip, metric, step, start)
+            ) WITHOUT ROWID
+            """
+        )
+        # Para borrar lo caducado sin recorrer las tablas enteras
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts)")
+        self._write_conn.execute(
+            "CREATE INDEX IF NOT EXISTS rollups_step_start ON rollups (step, start)"
+        )
+        self._write_conn.commit()
+        self._read_conn = self._connect()
+
+    async def start(self):
+        if not self.enabled or self._writer is not None:
+            return
+        await asyncio.to_thread(self._open)
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._stopping = asyncio.Event()
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Escribe lo que quede en la cola y cierra la base."""
+        if self._writer is None:
+            return
+        # Sin cancelar: una escritura a medias en el hilo seguiría usando
+        # la conexión mientras se cierra
+        self._stopping.set()
+        await self._writer
+        self._writer = None
+        await asyncio.to_thread(self._close)
+
+    def _close(self):
+        with self._read_lock:
+            for conn in (self._write_conn, self._read_conn):
+                if conn is not None:
+                    conn.close()
+            self._write_conn = self._read_conn = None
+
+    def append(self, ip: str, timestamp: float, metrics: dict[str, float]):
+        if self._writer is None or not metrics:
+            return
+        try:
+            self._queue.put_nowait((ip, timestamp, metrics))
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), HISTORY_DB_FLUSH_S)
+            except TimeoutError:
+                pass
+            await self._flush()
+            if self._stopping.is_set():
+                return
+            if time.monotonic() - self._pruned_at >= HISTORY_DB_PRUNE_S:
+                try:
+                    await asyncio.to_thread(self._prune, time.time())
+                except sqlite3.Error:
+                    self._stats["errors"] += 1
+                self._pruned_at = time.monotonic()
+
+    async def _flush(self):
+        while not self._queue.empty():
+            rows = []
+            while len(rows) < HISTORY_DB_BATCH_MAX and not self._queue.empty():
+                ip, timestamp, metrics = self._queue.get_nowait()
+                rows.extend(
+                    (ip, metric, timestamp, value) for metric, value in metrics.items()
+                )
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except sqlite3.Error:
+                self._stats["errors"] += 1
+                return
+            self._stats["written"] += len(rows)
+            self._stats["batches"] += 1
+
+    def _write(self, rows: list[tuple]):
+        rollups = [
+            (ip, metric, step, timestamp // step * step, value, value, value, value, timestamp)
+            for ip, metric, timestamp, value in rows
+            for step, _ in ROLLUP_TIERS
+        ]
+        with self._write_conn:
+            self._write_conn.executemany(INSERT_SAMPLE, rows)
+            self._write_conn.executemany(UPSERT_ROLLUP, rollups)
+
+    def _prune(self, now: float):
+        with self._write_conn:
+            self._write_conn.execute(
+                "DELETE FROM samples WHERE ts < ?", (now - HISTORY_DB_RAW_RETENTION_S,)
+            )
+            for step, retention in ROLLUP_TIERS:
+                self._write_conn.execute(
+                    "DELETE FROM rollups WHERE step = ? AND start < ?",
+                    (step, now - retention),
+                )
+
+    def window(
+        self,
+        ip: str,
+        metric: str,
+        since: float | None = None,
+        until: float | None = None,
+        step: float | None = None,
+        agg: str = "avg",
+    ) -> tuple[int | None, np.ndarray, np.ndarray, np.ndarray | None]:
+        """
+        (segundos por intervalo, timestamps, valores, muestras por
+        intervalo) de `metric` entre `since` y `until` (epoch, incluidos),
+        del nivel de agregados más grueso que no supera `step`, o de las
+        muestras sin agregar (nivel None, sin muestras por intervalo) si no
+        hay ninguno. Valores y muestras salen de la misma consulta.
+        Bloqueante: desde FastAPI se llama con asyncio.to_thread.
+        """
+        if agg not in ROLLUP_AGGS:
+            raise ValueError(f"Agregado no válido: {agg}")
+        tier = pick_tier([tier_step for tier_step, _ in ROLLUP_TIERS], step)
+        bounds = (
+            -np.inf if since is None else since,
+            np.inf if until is None else until,
+        )
+        if tier is None:
+            sql = """
+                SELECT ts, value, 1 FROM samples
+                WHERE ip = ? AND metric = ? AND ts >= ? AND ts <= ?
+                ORDER BY ts
+            """
+            params = (ip, metric, *bounds)
+        else:
+            # agg sale de la lista anterior, no del usuario
+            sql = f"""
+                SELECT start, {agg}, count FROM rollups
+                WHERE ip = ? AND metric = ? AND step = ? AND start >= ? AND start <= ?
+                ORDER BY start
+            """
+            params = (ip, metric, tier, *bounds)
+
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        points = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        return tier, points[:, 0], points[:, 1], None if tier is None else points[:, 2]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._writer is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self._stats,
+        }
+
+
+# Instancia global; main.py la arranca y la para en el lifespan de FastAPI
+history_db = SqliteHistory()
@@ -0,0 +1,137 @@
+# inventory.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Base de datos del inventario de dispositivos
+INVENTORY_DB = os.path.join(os.path.dirname(__file__), "inventory.db")
+
+DEVICE_FIELDS = ("ip", "alias", "community", "version", "poll_interval", "tags")
+
+
+class DeviceInventory:
+    """
+    Inventario persistente de dispositivos (SQLite).
+
+    Cada dispositivo guarda IP, alias, comunidad, versión SNMP, intervalo
+    de sondeo y etiquetas. El planificador de sondeos, las cachés y los
+    reportes trabajan con este conjunto conocido en lugar de escanear la
+    red con nmap.
+
+    Los métodos son síncronos y rápidos; desde FastAPI se llaman con
+    asyncio.to_thread como el resto de operaciones bloqueantes.
+    """
+
+    def __init__(self, path: str = INVENTORY_DB):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS devices (
+                    ip TEXT PRIMARY KEY,
+                    alias TEXT NOT NULL DEFAULT '',
+                    community TEXT NOT NULL DEFAULT 'public',
+                    version TEXT NOT NULL DEFAULT '2c',
+                    poll_interval REAL NOT NULL DEFAULT 10,
+                    tags TEXT NOT NULL DEFAULT '[]',
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        device = {field: row[field] for field in DEVICE_FIELDS}
+        device["tags"] = json.loads(row["tags"])
+        return device
+
+    def list(self, tag: str | None = None) -> list[dict]:
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM devices ORDER BY ip").fetchall()
+        devices = [self._to_dict(row) for row in rows]
+        if tag is not None:
+            devices = [device for device in devices if tag in device["tags"]]
+        return devices
+
+    def get(self, ip: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT * FROM devices WHERE ip = ?", (ip,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def create(self, device: dict) -> dict:
+        """Inserta un dispositivo; lanza KeyError si la IP ya existe."""
+        now = time.time()
+        values = {field: device[field] for field in DEVICE_FIELDS}
+        values["tags"] = json.dumps(list(values["tags"]))
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    """
+                    INSERT INTO devices
+                        (ip, alias, community, version, poll_interval, tags,
+                         created_at, updated_at)
+                    VALUES
+                        (:ip, :alias, :community, :version, :poll_interval, :tags,
+                         :now, :now)
+                    """,
+                    {**values, "now": now},
+                )
+                conn.commit()
+            except sqlite3.IntegrityError:
+                raise KeyError(device["ip"])
+        return self.get(device["ip"])
+
+    def update(self, ip: str, changes: dict) -> dict | None:
+        """Actualiza solo los campos indicados; None si la IP no existe."""
+        changes = {
+            field: value
+            for field, value in changes.items()
+            if field in DEVICE_FIELDS and field != "ip" and value is not None
+        }
+        if "tags" in changes:
+            changes["tags"] = json.dumps(list(changes["tags"]))
+
+        with self._lock:
+            conn = self._connect()
+            assignments = ", ".join(f"{field} = :{field}" for field in changes)
+            if assignments:
+                assignments += ", "
+            cursor = conn.execute(
+                f"UPDATE devices SET {assignments}updated_at = :now WHERE ip = :ip",
+                {**changes, "now": time.time(), "ip": ip},
+            )
+            conn.commit()
+            if cursor.rowcount == 0:
+                return None
+        return self.get(ip)
+
+    def delete(self, ip: str) -> bool:
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute("DELETE FROM devices WHERE ip = ?", (ip,))
+            conn.commit()
+        return cursor.rowcount > 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Instancia global usada por main.py
+device_inventory = DeviceInventory()
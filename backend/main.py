@@ -1,17 +1,66 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
+from typing import Literal
 
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 
 import asyncio
-from snmp_query import get_snmp_data, export_to_xml
+import json
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from snmp_query import (
+    get_snmp_snapshot,
+    export_to_xml,
+    snmp_manager,
+    capability_store,
+    build_auth_data,
+    DEFAULT_SNMP_VERSION,
+    BULK_MAX_REPETITIONS,
+)
+from poller import poll_scheduler, DEFAULT_POLL_INTERVAL_S, MIN_POLL_INTERVAL_S
+from inventory import device_inventory
+from history import history_store, bucketize, lttb, pick_tier, METRICS, ROLLUP_AGGS, ROLLUP_TIERS
+from archive import metric_archive
+from history_db import history_db
+from snmp_governor import (
+    request_governor,
+    sweep_limiter,
+    rtt_table,
+    circuit_breaker,
+    CircuitOpenError,
+)
+from snmp_cache import is_timeout
 from io import BytesIO
 import nmap
+import numpy as np
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único motor SNMP para todo el proceso
+    snmp_manager.start()
+    capability_store.load()
+    # Se sondean en segundo plano todos los dispositivos del inventario
+    for device in await asyncio.to_thread(device_inventory.list):
+        schedule_device(device)
+    await metric_archive.start()
+    await history_db.start()
+    await poll_scheduler.start()
+    yield
+    await poll_scheduler.stop()
+    await history_db.stop()
+    await metric_archive.stop()
+    snmp_manager.close()
+    device_inventory.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 NETWORK_RANGE = "192.168.10.0/24"
 
@@ -30,12 +79,195 @@ app.add_middleware(
     allow_headers=["*"],    # cabeceras permitidas
 )
 
+# El inventario solo guarda dispositivos v1/v2c: las claves USM de v3 no se
+# almacenan, así que los equipos v3 se consultan con /api/snmp pasando las
+# credenciales en cada petición
+InventoryVersion = Literal["1", "2c"]
+
+
+class DeviceIn(BaseModel):
+    ip: str
+    alias: str = ""
+    community: str = "public"
+    version: InventoryVersion = DEFAULT_SNMP_VERSION
+    poll_interval: float = Field(DEFAULT_POLL_INTERVAL_S, ge=MIN_POLL_INTERVAL_S)
+    tags: list[str] = []
+
+
+class DeviceUpdate(BaseModel):
+    alias: str | None = None
+    community: str | None = None
+    version: InventoryVersion | None = None
+    poll_interval: float | None = Field(None, ge=MIN_POLL_INTERVAL_S)
+    tags: list[str] | None = None
+
+
+def schedule_device(device: dict):
+    poll_scheduler.register(
+        device["ip"],
+        device["poll_interval"],
+        device["community"],
+        device["version"],
+    )
+
+
 def scan_network(network_range: str):
     nm = nmap.PortScanner()
     nm.scan(hosts=network_range, arguments='-sn -T4')
     active_hosts = [host for host in nm.all_hosts() if nm[host].state() == 'up']
     return active_hosts
 
+def validate_snmp_auth(
+    community: str | None,
+    version: str | None,
+    usm: dict | None = None,
+):
+    # Errores de versión/credenciales son del cliente, no del servidor
+    if version is None:
+        return
+    try:
+        build_auth_data(community or "public", version, usm)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def resolve_max_age(max_age: float | None, cache_control: str | None) -> float | None:
+    # El parámetro max_age tiene prioridad sobre la cabecera Cache-Control
+    if max_age is not None:
+        return max_age
+    if not cache_control:
+        return None
+    if "no-cache" in cache_control.lower():
+        return 0
+    match = re.search(r"max-age\s*=\s*(\d+)", cache_control, re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+async def sweep_targets(source: str, network: str) -> list[dict]:
+    """
+    Dispositivos a consultar en un barrido: los hosts activos de `network`
+    (nmap) o los del inventario, cada uno con su comunidad y versión.
+    """
+    if source == "inventory":
+        return await asyncio.to_thread(device_inventory.list)
+    if source != "network":
+        raise HTTPException(
+            status_code=400,
+            detail="Origen no válido. Usa 'network' o 'inventory'."
+        )
+    active_hosts = await asyncio.to_thread(scan_network, network)
+    return [{"ip": host, "community": None, "version": None} for host in active_hosts]
+
+
+def sweep_outcome(ip: str, result) -> bool | None:
+    """
+    Cómo le fue a un host del barrido (snapshot de get_snmp_snapshot),
+    para ajustar sweep_limiter:
+    - True: todas las secciones completas
+    - False: secciones a medias de un agente que aportó algo (o que ya
+      respondió antes)
+    - None: no se sabe nada de la red (excepción o host que nunca ha
+      respondido, p. ej. sin agente SNMP)
+    """
+    if not isinstance(result, dict):
+        return None
+    failed = sweep_failed(result)
+    if not failed and all(section["complete"] for section in result["sections"].values()):
+        return True
+    if not failed or capability_store.get(ip).get("version"):
+        return False
+    return None
+
+
+def sweep_failed(snapshot: dict) -> bool:
+    """
+    Un host que no aportó nada: sin datos, sin ninguna sección completa
+    (se cortó en el plazo) o con todos los valores en timeout.
+    """
+    data = snapshot["data"]
+    return (
+        not data
+        or not any(section["complete"] for section in snapshot["sections"].values())
+        or all(is_timeout(entry) for entry in data.values())
+    )
+
+
+async def iter_sweep(devices: list[dict], poll):
+    """
+    Ejecuta poll(device) para cada dispositivo con la concurrencia que
+    marque sweep_limiter y va devolviendo (posición, resultado o
+    excepción) según acaba cada host, sin esperar al más lento.
+
+    Los hosts se lanzan a medida que la ventana lo permite, así que en
+    memoria solo hay los sondeos en curso y los resultados aún no leídos.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    running: set[asyncio.Task] = set()
+
+    async def poll_one(position: int, device: dict, token: int):
+        result = None
+        try:
+            result = await poll(device)
+        except Exception as e:
+            result = e
+        finally:
+            await sweep_limiter.release(token, sweep_outcome(device["ip"], result))
+        queue.put_nowait((position, result))
+
+    async def launch():
+        for position, device in enumerate(devices):
+            token = await sweep_limiter.acquire()
+            task = asyncio.create_task(poll_one(position, device, token))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+    launcher = asyncio.create_task(launch())
+    try:
+        for _ in devices:
+            yield await queue.get()
+    finally:
+        # Si el cliente se va a mitad del barrido se cancela lo pendiente
+        launcher.cancel()
+        for task in list(running):
+            task.cancel()
+
+
+async def run_sweep(devices: list[dict], poll) -> list:
+    """
+    Como iter_sweep, pero espera a todos y devuelve los resultados en el
+    mismo orden que `devices`, como asyncio.gather(return_exceptions=True).
+    """
+    results = [None] * len(devices)
+    async for position, result in iter_sweep(devices, poll):
+        results[position] = result
+    return results
+
+
+def sweep_entry(ip: str, result) -> dict:
+    # Los hosts con el circuito abierto no son un error: se omitieron a propósito
+    if isinstance(result, CircuitOpenError):
+        return {"IP": ip, "skipped": "circuit-open"}
+    if isinstance(result, Exception):
+        return {"IP": ip, "Error": str(result)}
+
+    sections = result["sections"]
+    entry = {
+        "IP": ip,
+        "Complete": all(section["complete"] for section in sections.values()),
+        "Sections": sections,
+        "Data": result["data"],
+    }
+    if sweep_failed(result):
+        entry["Error"] = "El dispositivo no respondió a SNMP"
+    return entry
+
+
+def no_devices_message(source: str, network: str) -> str:
+    if source == "inventory":
+        return "No hay dispositivos registrados en el inventario"
+    return f"No se encontraron dispositivos activos en la red {network}"
+
+
 @app.get("/api/snmp/")
 async def snmp_api(
     ip: str | None = Query(
@@ -49,7 +281,42 @@ async def snmp_api(
     format: str = Query(
         "json",
         description="Formato de salida: json o xml (xml solo para una IP específica)"
-    )
+    ),
+    community: str | None = Query(
+        None,
+        description="Comunidad SNMP (v1/v2c). Si se omite se usa la aprendida o 'public'"
+    ),
+    version: str | None = Query(
+        None,
+        description=f"Versión SNMP: 1, 2c o 3. Si se omite se usa la aprendida o {DEFAULT_SNMP_VERSION}"
+    ),
+    max_repetitions: int = Query(
+        BULK_MAX_REPETITIONS,
+        ge=1,
+        le=100,
+        description="Filas por columna en cada GETBULK (v2c/v3)"
+    ),
+    v3_user: str | None = Query(None, description="Usuario SNMPv3"),
+    # Las claves van en cabeceras para que no queden en URLs ni en los logs de acceso
+    v3_auth_key: str | None = Header(None, alias="X-SNMPv3-Auth-Key", description="Clave de autenticación SNMPv3"),
+    v3_priv_key: str | None = Header(None, alias="X-SNMPv3-Priv-Key", description="Clave de privacidad SNMPv3"),
+    v3_auth_protocol: str = Query("SHA", description="MD5, SHA, SHA256 o SHA512"),
+    v3_priv_protocol: str = Query("AES", description="DES, AES o AES256"),
+    max_age: float | None = Query(
+        None,
+        ge=0,
+        description="Acepta un sondeo guardado de como mucho estos segundos (solo con 'ip')"
+    ),
+    cache_control: str | None = Header(None),
+    timeout_ms: int | None = Query(
+        None,
+        ge=1,
+        description="Plazo del sondeo en ms (solo con 'ip'); al cumplirse se devuelve lo recogido"
+    ),
+    source: str = Query(
+        "network",
+        description="Sin 'ip': 'network' escanea la red con nmap, 'inventory' usa el inventario"
+    ),
 ):
     try:
         # Validar formato
@@ -60,37 +327,93 @@ async def snmp_api(
                 detail="Formato no válido. Usa 'json' o 'xml'."
             )
 
+        usm = None
+        if version == "3":
+            usm = {
+                "user": v3_user,
+                "auth_key": v3_auth_key,
+                "priv_key": v3_priv_key,
+                "auth_protocol": v3_auth_protocol,
+                "priv_protocol": v3_priv_protocol,
+            }
+        validate_snmp_auth(community, version, usm)
+
+        def poll(device: dict):
+            return get_snmp_snapshot(
+                device["ip"],
+                community or device["community"],
+                version or device["version"],
+                usm,
+                max_repetitions,
+            )
+
         if ip:
-            data = await get_snmp_data(ip)
+            accepted_age = resolve_max_age(max_age, cache_control)
+
+            # Dispositivo sondeado en segundo plano: se sirve su último dato
+            # si es reciente y la petición no cambia credenciales ni perfil
+            overrides = (
+                community is not None
+                or version is not None
+                or max_repetitions != BULK_MAX_REPETITIONS
+                or timeout_ms is not None
+            )
+            snapshot = None
+            if accepted_age != 0 and not overrides:
+                snapshot = poll_scheduler.fresh(ip, accepted_age)
+
+            if snapshot is None:
+                snapshot = await get_snmp_snapshot(
+                    ip,
+                    community,
+                    version,
+                    usm,
+                    max_repetitions,
+                    max_age=accepted_age,
+                    timeout=timeout_ms / 1000 if timeout_ms is not None else None,
+                )
+            data = snapshot["data"]
+            sections = snapshot["sections"]
+            complete = all(section["complete"] for section in sections.values())
+            timestamp = datetime.fromtimestamp(snapshot["timestamp"], timezone.utc).isoformat()
+            age = round(snapshot["age"], 3)
+            headers = {
+                "Age": str(int(age)),
+                "X-Sample-Timestamp": timestamp,
+                "X-Complete": "true" if complete else "false",
+            }
 
             if fmt == "json":
-                return JSONResponse(content={"IP": ip, "Data": data})
+                return JSONResponse(
+                    content={
+                        "IP": ip,
+                        "Timestamp": timestamp,
+                        "Age": age,
+                        "Complete": complete,
+                        "Sections": sections,
+                        "Data": data,
+                    },
+                    headers=headers,
+                )
             else:  # xml
                 xml_data = export_to_xml(data)
-                return Response(content=xml_data, media_type="application/xml")
+                return Response(
+                    content=xml_data, media_type="application/xml", headers=headers
+                )
 
-        active_hosts = await asyncio.to_thread(scan_network, network)
+        devices = await sweep_targets(source, network)
 
-        if not active_hosts:
+        if not devices:
             return JSONResponse(
-                content={"message": f"No se encontraron dispositivos activos en la red {network}"}
+                content={"message": no_devices_message(source, network)}
             )
 
-        tasks = [get_snmp_data(host_ip) for host_ip in active_hosts]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        results = await run_sweep(devices, poll)
 
-        snmp_results = []
-        for host_ip, result in zip(active_hosts, results):
-            if isinstance(result, Exception):
-                snmp_results.append({
-                    "IP": host_ip,
-                    "Error": str(result)
-                })
-            else:
-                snmp_results.append({
-                    "IP": host_ip,
-                    "Data": result
-                })
+        snmp_results = [
+            sweep_entry(device["ip"], result)
+            for device, result in zip(devices, results)
+        ]
 
         if fmt == "json":
             return JSONResponse(content={"active_devices": snmp_results})
@@ -104,6 +427,12 @@ async def snmp_api(
     except HTTPException:
         # ya formateado arriba
         raise
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"El dispositivo no responde a SNMP; se omite temporalmente ({e})",
+            headers={"Retry-After": str(int(e.retry_in) + 1)},
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -111,24 +440,402 @@ async def snmp_api(
         )
 
 
+@app.get("/api/poller/")
+async def poller_status():
+    return JSONResponse(content={"devices": poll_scheduler.status()})
+
+
+def snapshot_diff(ip: str, snapshot: dict, last: dict[str, dict]) -> dict | None:
+    """
+    Mensaje con lo que cambió respecto a `last` (lo último enviado a ese
+    cliente), que se actualiza. None si no cambió nada.
+    """
+    data = snapshot["data"]
+    changed = {key: entry for key, entry in data.items() if last.get(key) != entry}
+    removed = [key for key in last if key not in data]
+    full = not last
+    if not changed and not removed:
+        return None
+    last.clear()
+    last.update(data)
+    return {
+        "IP": ip,
+        "Timestamp": datetime.fromtimestamp(snapshot["timestamp"], timezone.utc).isoformat(),
+        "Full": full,
+        "Sections": snapshot.get("sections"),
+        "Changed": changed,
+        "Removed": removed,
+    }
+
+
+async def wait_disconnect(websocket: WebSocket):
+    # El cliente no envía nada; se lee solo para enterarse de que se fue
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@app.websocket("/ws/devices/{ip}")
+async def device_updates(
+    websocket: WebSocket,
+    ip: str,
+    interval: float = Query(DEFAULT_POLL_INTERVAL_S, ge=MIN_POLL_INTERVAL_S),
+):
+    """
+    Métricas de un dispositivo en vivo. Todos los clientes del mismo
+    dispositivo comparten el bucle de sondeo de poll_scheduler (si no está
+    en el inventario se sondea cada `interval` mientras haya alguien
+    conectado). El primer mensaje trae todos los datos (Full = true) y los
+    siguientes solo las claves que cambiaron (Changed) o desaparecieron
+    (Removed).
+    """
+    await websocket.accept()
+    queue = poll_scheduler.subscribe(ip, interval)
+    disconnected = asyncio.ensure_future(wait_disconnect(websocket))
+    last: dict[str, dict] = {}
+
+    try:
+        snapshot = poll_scheduler.latest(ip)
+        while True:
+            if snapshot is not None:
+                message = snapshot_diff(ip, snapshot, last)
+                if message is not None:
+                    await websocket.send_json(message)
+
+            update = asyncio.ensure_future(queue.get())
+            await asyncio.wait(
+                {update, disconnected}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected.done():
+                update.cancel()
+                break
+            snapshot = update.result()
+    except (WebSocketDisconnect, RuntimeError):
+        # Conexión cerrada a mitad de un envío
+        pass
+    finally:
+        disconnected.cancel()
+        poll_scheduler.unsubscribe(ip, queue)
+
+
+# Tiempo sin eventos tras el que se envía un comentario SSE para que
+# proxies y navegadores no cierren la conexión
+SSE_KEEPALIVE_S = 15
+
+
+async def stream_devices(ips: list[str], interval: float, flush_s: float):
+    """
+    Eventos SSE "update" con los cambios de varios dispositivos. Cada
+    `flush_s` se juntan en un solo evento los dispositivos con sondeos
+    nuevos, cada uno con su diff (ver snapshot_diff). El primer evento
+    trae los datos completos de los que ya tienen algún sondeo.
+    """
+    queues = {ip: poll_scheduler.subscribe(ip, interval) for ip in ips}
+    last: dict[str, dict[str, dict]] = {ip: {} for ip in ips}
+    pending = {ip: poll_scheduler.latest(ip) for ip in ips}
+    loop = asyncio.get_running_loop()
+    last_sent = loop.time()
+
+    try:
+        while True:
+            for ip, queue in queues.items():
+                if not queue.empty():
+                    pending[ip] = queue.get_nowait()
+
+            batch = []
+            for ip, snapshot in pending.items():
+                if snapshot is None:
+                    continue
+                message = snapshot_diff(ip, snapshot, last[ip])
+                if message is not None:
+                    batch.append(message)
+            pending = {}
+
+            if batch:
+                yield sse_event("update", {
+                    "Timestamp": datetime.now(timezone.utc).isoformat(),
+                    "Devices": batch,
+                })
+                last_sent = loop.time()
+            elif loop.time() - last_sent >= SSE_KEEPALIVE_S:
+                yield ": keep-alive\n\n"
+                last_sent = loop.time()
+
+            await asyncio.sleep(flush_s)
+    finally:
+        for ip, queue in queues.items():
+            poll_scheduler.unsubscribe(ip, queue)
+
+
+@app.get("/api/stream")
+async def device_stream(
+    devices: str | None = Query(None, description="IPs separadas por comas"),
+    tag: str | None = Query(None, description="Todos los dispositivos del inventario con esta etiqueta"),
+    flush_ms: int = Query(500, ge=50, le=60000, description="Cada cuánto se envían los cambios acumulados"),
+    interval: float = Query(
+        DEFAULT_POLL_INTERVAL_S,
+        ge=MIN_POLL_INTERVAL_S,
+        description="Intervalo de sondeo de los dispositivos que no están en el inventario",
+    ),
+):
+    """
+    Un único stream SSE con las métricas de muchos dispositivos, para
+    paneles que muestran cientos de equipos sin abrir una conexión por
+    cada uno. Comparte los bucles de sondeo con /ws/devices/{ip}.
+    """
+    ips = [ip.strip() for ip in (devices or "").split(",") if ip.strip()]
+    if tag is not None:
+        ips += [device["ip"] for device in await asyncio.to_thread(device_inventory.list, tag)]
+    ips = list(dict.fromkeys(ips))
+    if not ips:
+        raise HTTPException(
+            status_code=400,
+            detail="Indica 'devices' o una 'tag' con dispositivos en el inventario",
+        )
+
+    return StreamingResponse(
+        stream_devices(ips, interval, flush_ms / 1000),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/api/snmp/governor/")
+async def governor_status():
+    """
+    Límites de PDUs en vuelo, métricas de saturación, ventana de barridos,
+    RTT/timeout medidos de cada host, hosts con el circuito abierto y
+    estado de los históricos (memoria, archivo en disco y SQLite).
+    """
+    return JSONResponse(
+        content={
+            **request_governor.stats(),
+            "sweep": sweep_limiter.stats(),
+            "rtt": rtt_table.stats(),
+            "circuits": circuit_breaker.stats(),
+            "history": {
+                "memory": history_store.stats(),
+                "archive": metric_archive.stats(),
+                "sqlite": history_db.stats(),
+            },
+        }
+    )
+
+
+@app.get("/api/devices")
+async def list_devices(tag: str | None = Query(None, description="Filtrar por etiqueta")):
+    devices = await asyncio.to_thread(device_inventory.list, tag)
+    return JSONResponse(content={"devices": devices})
+
+
+@app.post("/api/devices", status_code=201)
+async def create_device(device: DeviceIn):
+    validate_snmp_auth(device.community, device.version)
+    try:
+        created = await asyncio.to_thread(device_inventory.create, device.model_dump())
+    except KeyError:
+        raise HTTPException(
+            status_code=409, detail=f"Ya existe un dispositivo con la IP {device.ip}"
+        )
+    schedule_device(created)
+    return JSONResponse(content=created, status_code=201)
+
+
+@app.get("/api/devices/{ip}")
+async def get_device(ip: str):
+    device = await asyncio.to_thread(device_inventory.get, ip)
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"El dispositivo {ip} no existe")
+    return JSONResponse(content=device)
+
+
+async def load_history(
+    ip: str,
+    metric: str,
+    since: float | None,
+    until: float | None,
+    step: float | None,
+    agg: str,
+) -> tuple[str, np.ndarray, np.ndarray, np.ndarray | None] | None:
+    """
+    (origen, timestamps, valores, muestras por punto) de la fuente más
+    barata que sirve la resolución pedida; None si ninguna tiene la serie.
+
+    - Sin `step` o con uno más fino que el nivel de agregados más fino:
+      muestras sin agregar del histórico en memoria, o de SQLite si está
+      activo y `since` queda antes de lo que guarda la memoria.
+    - Si no, el nivel más grueso que no supera `step`, del archivo en disco
+      o, si no tiene la serie, de SQLite.
+    """
+    tier = pick_tier([tier_step for tier_step, _ in ROLLUP_TIERS], step)
+    if tier is None:
+        window = history_store.window(ip, metric, since, until)
+        first = history_store.first_timestamp(ip)
+        covered = first is not None and (since is None or first <= since)
+        if covered or not history_db.enabled:
+            return None if window is None else ("memory", *window, None)
+        _, timestamps, values, _ = await asyncio.to_thread(
+            history_db.window, ip, metric, since, until
+        )
+        # SQLite vacío (recién activado, o sin escribir aún): lo que haya en memoria
+        if not len(timestamps) and window is not None:
+            return "memory", *window, None
+        return "sqlite", timestamps, values, None
+
+    window = metric_archive.window(ip, metric, since, until, step, agg)
+    if window is not None:
+        _, starts, values, counts = window
+        return "archive", starts, values, counts if agg == "avg" else None
+    if not history_db.enabled:
+        return None
+
+    _, timestamps, values, counts = await asyncio.to_thread(
+        history_db.window, ip, metric, since, until, step, agg
+    )
+    return "sqlite", timestamps, values, counts if agg == "avg" else None
+
+
+@app.get("/api/devices/{ip}/history")
+async def device_history(
+    ip: str,
+    metric: str = Query(..., description=f"Métrica: {', '.join(METRICS)}"),
+    since: float | None = Query(None, alias="from", description="Desde (epoch, segundos)"),
+    until: float | None = Query(None, alias="to", description="Hasta (epoch, segundos)"),
+    step: float | None = Query(None, gt=0, description="Resolución en segundos; sin ella, muestras sin agregar"),
+    agg: str = Query("avg", description=f"Agregado por intervalo: {', '.join(ROLLUP_AGGS)}"),
+    points: int | None = Query(None, ge=3, description="Máximo de puntos (LTTB) para gráficas"),
+):
+    if metric not in METRICS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Métrica no válida. Usa una de: {', '.join(METRICS)}",
+        )
+    if agg not in ROLLUP_AGGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Agregado no válido. Usa uno de: {', '.join(ROLLUP_AGGS)}",
+        )
+    history = await load_history(ip, metric, since, until, step, agg)
+    if history is None:
+        raise HTTPException(status_code=404, detail=f"No hay histórico de {ip}")
+
+    source, timestamps, values, weights = history
+    if step is None:
+        valid = ~np.isnan(values)
+        timestamps, values = timestamps[valid], values[valid]
+    else:
+        timestamps, values = bucketize(timestamps, values, step, agg, weights)
+    if points is not None:
+        timestamps, values = lttb(timestamps, values, points)
+    return JSONResponse(content={
+        "IP": ip,
+        "metric": metric,
+        "step": step,
+        "agg": agg if step is not None else None,
+        "source": source,
+        "points": np.column_stack((timestamps, values)).tolist(),
+    })
+
+
+@app.put("/api/devices/{ip}")
+async def update_device(ip: str, changes: DeviceUpdate):
+    if changes.version is not None:
+        validate_snmp_auth(changes.community, changes.version)
+    device = await asyncio.to_thread(device_inventory.update, ip, changes.model_dump())
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"El dispositivo {ip} no existe")
+    schedule_device(device)
+    return JSONResponse(content=device)
+
+
+@app.delete("/api/devices/{ip}")
+async def delete_device(ip: str):
+    if not await asyncio.to_thread(device_inventory.delete, ip):
+        raise HTTPException(status_code=404, detail=f"El dispositivo {ip} no existe")
+    # Quien siga suscrito (WebSocket/SSE) sigue recibiendo sondeos
+    poll_scheduler.release(ip)
+    return JSONResponse(content={"IP": ip, "removed": True})
+
+
+def stream_format(accept: str | None) -> str | None:
+    """'ndjson', 'sse' o None (JSON normal) según la cabecera Accept."""
+    accept = (accept or "").lower()
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    if "text/event-stream" in accept:
+        return "sse"
+    return None
+
+
+def sse_event(kind: str, record: dict) -> str:
+    return f"event: {kind}\ndata: {json.dumps(record, ensure_ascii=False)}\n\n"
+
+
+async def stream_sweep(devices: list[dict], poll, stream: str):
+    """
+    Barrido en streaming: una línea NDJSON (o un evento SSE "host") por
+    host en cuanto termina, y al final un registro "summary" con el total.
+    """
+    def encode(kind: str, record: dict) -> str:
+        if stream == "sse":
+            return sse_event(kind, record)
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    started = time.monotonic()
+    summary = {"hosts": len(devices), "ok": 0, "errors": 0, "skipped": 0}
+    async for position, result in iter_sweep(devices, poll):
+        entry = sweep_entry(devices[position]["ip"], result)
+        if "skipped" in entry:
+            summary["skipped"] += 1
+        elif "Error" in entry:
+            summary["errors"] += 1
+        else:
+            summary["ok"] += 1
+        yield encode("host", entry)
+
+    summary["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    yield encode("summary", {"summary": summary})
+
+
 @app.get("/api/snmp/network-scan/")
-async def snmp_network_scan(network: str = Query(NETWORK_RANGE, description="Rango de red para escanear")):
+async def snmp_network_scan(
+    network: str = Query(NETWORK_RANGE, description="Rango de red para escanear"),
+    community: str | None = Query(None, description="Comunidad SNMP"),
+    version: str | None = Query(None, description="Versión SNMP: 1 o 2c"),
+    accept: str | None = Header(None),
+):
+    """
+    Con Accept: application/x-ndjson o text/event-stream los resultados
+    se envían host a host según llegan (ver stream_sweep).
+    """
+    validate_snmp_auth(community, version)
+    stream = stream_format(accept)
+
     try:
         active_hosts = await asyncio.to_thread(scan_network, network)
 
         if not active_hosts:
             return JSONResponse(content={"message": f"No se encontraron dispositivos activos en la red {network}"})
-    
-        tasks = [get_snmp_data(ip) for ip in active_hosts]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
 
-        snmp_results = []
-        for ip, data in zip(active_hosts, results):
-            if isinstance(data, Exception):
-                snmp_results.append({"IP": ip, "Error": str(data)})
-            else:
-                snmp_results.append({"IP": ip, "Data": data})
+        devices = [{"ip": ip} for ip in active_hosts]
+
+        def poll(device: dict):
+            return get_snmp_snapshot(device["ip"], community, version)
+
+        if stream is not None:
+            media_type = "application/x-ndjson" if stream == "ndjson" else "text/event-stream"
+            return StreamingResponse(
+                stream_sweep(devices, poll, stream),
+                media_type=media_type,
+                headers={"Cache-Control": "no-cache"},
+            )
+
+        results = await run_sweep(devices, poll)
+
+        snmp_results = [
+            sweep_entry(ip, data) for ip, data in zip(active_hosts, results)
+        ]
         
         return JSONResponse(content={"active_devices": snmp_results})
 
@@ -137,16 +844,25 @@ async def snmp_network_scan(network: str = Query(NETWORK_RANGE, description="Ran
 
 
 @app.get("/api/snmp/report")
-async def generate_snmp_report():
+async def generate_snmp_report(
+    source: str = Query(
+        "network",
+        description="'network' escanea la red con nmap, 'inventory' usa el inventario"
+    ),
+):
+    devices = await sweep_targets(source, NETWORK_RANGE)
+
     try:
-        active_hosts = await asyncio.to_thread(scan_network, NETWORK_RANGE)
+        if not devices:
+            return JSONResponse(content={"message": no_devices_message(source, NETWORK_RANGE)})
 
-        if not active_hosts:
-            return JSONResponse(content={"message": f"No se encontraron dispositivos activos en la red {NETWORK_RANGE}"})
-    
-        tasks = [get_snmp_data(ip) for ip in active_hosts]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        active_hosts = [device["ip"] for device in devices]
+        results = await run_sweep(
+            devices,
+            lambda device: get_snmp_snapshot(
+                device["ip"], device["community"], device["version"]
+            ),
+        )
 
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=letter)
@@ -156,12 +872,18 @@ async def generate_snmp_report():
         flowables.append(Paragraph("<b>Reporte SNMP de Dispositivos en la Red</b>", styles['Title']))
         flowables.append(Spacer(1, 12))
 
-        for ip, data in zip(active_hosts, results):
+        for ip, result in zip(active_hosts, results):
             flowables.append(Paragraph(f"<b>Dispositivo: {ip}</b>", styles['Heading2']))
-            if isinstance(data, Exception):
-                flowables.append(Paragraph(f"Error al obtener datos SNMP: {str(data)}", styles['Normal']))
+            entry = sweep_entry(ip, result)
+            if "skipped" in entry:
+                flowables.append(Paragraph("Omitido: no responde a SNMP (circuit-open)", styles['Normal']))
+            elif "Error" in entry:
+                flowables.append(Paragraph(f"Error al obtener datos SNMP: {entry['Error']}", styles['Normal']))
             else:
-                for name, content in data.items():
+                pending = [name for name, section in entry["Sections"].items() if not section["complete"]]
+                if pending:
+                    flowables.append(Paragraph(f"Datos incompletos: {', '.join(pending)}", styles['Normal']))
+                for name, content in entry["Data"].items():
                     flowables.append(Paragraph(f"<b>{name}:</b> {content['Valor']}", styles['Normal']))
             flowables.append(Spacer(1, 12))
         
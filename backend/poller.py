@@ -0,0 +1,212 @@
+# poller.py
+import asyncio
+import random
+import time
+
+from snmp_query import get_snmp_snapshot
+
+# Intervalo de sondeo por defecto y mínimo permitido (segundos)
+DEFAULT_POLL_INTERVAL_S = 10
+MIN_POLL_INTERVAL_S = 1
+# Un sondeo guardado deja de servir tras este número de intervalos
+STALE_INTERVALS = 2
+
+
+class PollScheduler:
+    """
+    Sondea en segundo plano los dispositivos registrados.
+
+    Cada dispositivo tiene su propia tarea con su intervalo. El primer
+    sondeo se retrasa un tiempo aleatorio dentro del intervalo para que no
+    salgan todos a la vez. Los endpoints leen el último resultado con
+    latest() en lugar de consultar la red, o se suscriben con subscribe()
+    para recibir cada sondeo nuevo: muchos clientes del mismo dispositivo
+    comparten un único bucle de sondeo.
+    """
+
+    def __init__(self):
+        self._devices: dict[str, dict] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._latest: dict[str, dict] = {}
+        self._stats: dict[str, dict] = {}
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._running = False
+
+    def register(
+        self,
+        ip: str,
+        interval: float = DEFAULT_POLL_INTERVAL_S,
+        community: str | None = None,
+        version: str | None = None,
+        usm: dict | None = None,
+        on_demand: bool = False,
+    ):
+        """
+        Añade o actualiza un dispositivo; si ya se sondeaba se reinicia.
+        Los `on_demand` solo se sondean mientras tienen suscriptores.
+        """
+        self._devices[ip] = {
+            "interval": max(float(interval), MIN_POLL_INTERVAL_S),
+            "community": community,
+            "version": version,
+            "usm": usm,
+            "on_demand": on_demand,
+        }
+        self._stats.setdefault(ip, {"polls": 0, "errors": 0, "last_error": None})
+        if self._running:
+            self._restart(ip)
+
+    def unregister(self, ip: str):
+        self._devices.pop(ip, None)
+        self._latest.pop(ip, None)
+        self._stats.pop(ip, None)
+        task = self._tasks.pop(ip, None)
+        if task is not None:
+            task.cancel()
+
+    def release(self, ip: str):
+        """
+        Deja de sondear `ip` de forma fija (p. ej. al borrarlo del
+        inventario). Si aún tiene suscriptores sigue como bajo demanda,
+        sin cortarles el sondeo, hasta que se vaya el último.
+        """
+        config = self._devices.get(ip)
+        if config is not None and self._subscribers.get(ip):
+            config["on_demand"] = True
+        else:
+            self.unregister(ip)
+
+    def subscribe(self, ip: str, interval: float = DEFAULT_POLL_INTERVAL_S) -> asyncio.Queue:
+        """
+        Cola que recibe el snapshot de cada sondeo nuevo de `ip` (como
+        latest()). Si solo guarda el último, un cliente lento se salta
+        sondeos en lugar de acumularlos. Un dispositivo que no estaba
+        registrado se sondea cada `interval` mientras tenga suscriptores.
+        """
+        if ip not in self._devices:
+            self.register(ip, interval, on_demand=True)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(ip, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, ip: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(ip)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if subscribers:
+            return
+        del self._subscribers[ip]
+        config = self._devices.get(ip)
+        if config is not None and config["on_demand"]:
+            self.unregister(ip)
+
+    def _publish(self, ip: str):
+        snapshot = self.latest(ip)
+        for queue in self._subscribers.get(ip, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    async def start(self):
+        self._running = True
+        for ip in self._devices:
+            self._restart(ip)
+
+    async def stop(self):
+        self._running = False
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def latest(self, ip: str) -> dict | None:
+        """Último sondeo de `ip` como {'data', 'timestamp', 'age', 'sections'}."""
+        snapshot = self._latest.get(ip)
+        if snapshot is None:
+            return None
+        return {
+            "data": snapshot["data"],
+            "timestamp": snapshot["timestamp"],
+            "age": time.monotonic() - snapshot["sampled"],
+            "sections": snapshot["sections"],
+        }
+
+    def fresh(self, ip: str, max_age: float | None = None) -> dict | None:
+        """
+        latest(ip) solo si aún vale como respuesta: como mucho `max_age`
+        segundos de antigüedad (STALE_INTERVALS intervalos si no se indica)
+        y sin que el último sondeo haya fallado. None si hay que consultar
+        el dispositivo.
+        """
+        snapshot = self.latest(ip)
+        if snapshot is None or self._stats[ip]["last_error"] is not None:
+            return None
+        if max_age is None:
+            max_age = STALE_INTERVALS * self._devices[ip]["interval"]
+        return snapshot if snapshot["age"] <= max_age else None
+
+    def status(self) -> list[dict]:
+        now = time.monotonic()
+        status = []
+        for ip, config in self._devices.items():
+            snapshot = self._latest.get(ip)
+            status.append({
+                "IP": ip,
+                "interval": config["interval"],
+                "on_demand": config["on_demand"],
+                "subscribers": len(self._subscribers.get(ip, ())),
+                "last_poll": snapshot["timestamp"] if snapshot else None,
+                "age": now - snapshot["sampled"] if snapshot else None,
+                **self._stats.get(ip, {}),
+            })
+        return status
+
+    def _restart(self, ip: str):
+        task = self._tasks.pop(ip, None)
+        if task is not None:
+            task.cancel()
+        self._tasks[ip] = asyncio.create_task(self._run(ip))
+
+    async def _run(self, ip: str):
+        config = self._devices[ip]
+        interval = config["interval"]
+        loop = asyncio.get_running_loop()
+
+        # Arranque escalonado; alguien espera ya a los que van bajo demanda
+        if not config["on_demand"]:
+            await asyncio.sleep(random.uniform(0, interval))
+        next_at = loop.time()
+
+        while True:
+            stats = self._stats[ip]
+            try:
+                snapshot = await get_snmp_snapshot(
+                    ip, config["community"], config["version"], config["usm"]
+                )
+                self._latest[ip] = {
+                    "data": snapshot["data"],
+                    "timestamp": snapshot["timestamp"],
+                    "sampled": time.monotonic() - snapshot["age"],
+                    "sections": snapshot["sections"],
+                }
+                stats["polls"] += 1
+                stats["last_error"] = None
+                self._publish(ip)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats["errors"] += 1
+                stats["last_error"] = str(e)
+
+            # Ritmo fijo; si un sondeo se alargó se saltan los turnos perdidos
+            next_at += interval
+            now = loop.time()
+            while next_at < now:
+                next_at += interval
+            await asyncio.sleep(next_at - now)
+
+
+# Instancia global; main.py la arranca y la para en el lifespan de FastAPI
+poll_scheduler = PollScheduler()
@@ -0,0 +1,236 @@
+# snmp_cache.py
+import json
+import os
+import time
+from collections import OrderedDict
+
+# Cada cuánto se vuelve a descubrir la estructura de un dispositivo
+LAYOUT_TTL_S = 900
+
+# Claves de uptime que se comparan para detectar reinicios
+UPTIME_KEYS = ("hrSystemUptime", "_sysUpTime")
+
+# Tiempo máximo que se guarda un sondeo y número máximo de sondeos en memoria
+SNAPSHOT_TTL_S = 60
+SNAPSHOT_MAX_ENTRIES = 1024
+
+# Fichero donde persisten las capacidades aprendidas de cada dispositivo
+CAPABILITIES_FILE = os.path.join(os.path.dirname(__file__), "snmp_capabilities.json")
+
+
+def _ticks(entry: dict | None) -> int | None:
+    if not entry:
+        return None
+    val = str(entry.get("Valor", ""))
+    return int(val) if val.isdigit() else None
+
+
+def is_missing(entry: dict | None) -> bool:
+    """
+    True si la entrada indica que el OID no existe en el agente
+    (noSuchObject / noSuchInstance en v2c, noSuchName en v1).
+    """
+    if entry is None:
+        return True
+    val = str(entry.get("Valor", ""))
+    return "No Such" in val or val.startswith("Error:")
+
+
+def is_timeout(entry: dict | None) -> bool:
+    """True si el agente no respondió a la petición de esta entrada."""
+    if entry is None:
+        return False
+    return "before timeout" in str(entry.get("Valor", ""))
+
+
+class LayoutCache:
+    """
+    Estructura descubierta de cada dispositivo, por IP.
+
+    Descubrir qué índices de hrProcessorLoad existen, qué fila de
+    hrStorage es RAM o disco y qué interfaz está activa cuesta varios
+    recorridos de tablas, y casi nunca cambia. Aquí se guarda el plan de
+    OIDs hoja resultante para que los sondeos normales hagan un solo GET.
+
+    Cada entrada tiene:
+    - plan: {clave: oid} que se pide en cada sondeo
+    - static: entradas que no salen de un OID (p. ej. "no encontrado")
+    - required: claves del plan que deben existir; si falta alguna la
+      estructura ha cambiado
+    - expect: {clave: valor} que debe mantenerse (p. ej. ifOperStatus = 1)
+    - uptimes: últimos valores de UPTIME_KEYS; si retroceden el equipo
+      se reinició y la entrada se descarta
+    """
+
+    def __init__(self, ttl: float = LAYOUT_TTL_S):
+        self.ttl = ttl
+        self._entries: dict[str, dict] = {}
+
+    def get(self, ip: str) -> dict | None:
+        entry = self._entries.get(ip)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry["expires"]:
+            del self._entries[ip]
+            return None
+        return entry
+
+    def put(
+        self,
+        ip: str,
+        plan: dict[str, str],
+        static: dict[str, dict],
+        results: dict[str, dict],
+        required: list[str],
+        expect: dict[str, str] | None = None,
+    ):
+        self._entries[ip] = {
+            "plan": dict(plan),
+            "static": dict(static),
+            "required": list(required),
+            "expect": dict(expect or {}),
+            "uptimes": {key: _ticks(results.get(key)) for key in UPTIME_KEYS},
+            "expires": time.monotonic() + self.ttl,
+        }
+
+    def invalidate(self, ip: str):
+        self._entries.pop(ip, None)
+
+    def validate(self, ip: str, results: dict[str, dict]) -> bool:
+        """
+        Comprueba un sondeo hecho con el plan cacheado. Si el dispositivo
+        se reinició o la estructura cambió, descarta la entrada y
+        devuelve False.
+        """
+        entry = self._entries.get(ip)
+        if entry is None:
+            return False
+
+        for key in UPTIME_KEYS:
+            old = entry["uptimes"].get(key)
+            new = _ticks(results.get(key))
+            if old is not None and new is not None and new < old:
+                self.invalidate(ip)
+                return False
+
+        if any(is_missing(results.get(key)) for key in entry["required"]):
+            self.invalidate(ip)
+            return False
+
+        # Solo cuenta un valor real distinto; un timeout no cambia la estructura
+        for key, value in entry["expect"].items():
+            got = _ticks(results.get(key))
+            if got is not None and str(got) != value:
+                self.invalidate(ip)
+                return False
+
+        for key in UPTIME_KEYS:
+            ticks = _ticks(results.get(key))
+            if ticks is not None:
+                entry["uptimes"][key] = ticks
+        return True
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CapabilityStore:
+    """
+    Capacidades de protocolo aprendidas de cada dispositivo, por IP:
+
+    - version: versión SNMP que responde ("1", "2c", "3")
+    - community: comunidad con la que respondió
+    - bulk: si acepta GETBULK
+    - max_varbinds: OIDs por GET que acepta sin responder tooBig
+    - hc_counters: si tiene ifHCIn/OutOctets (64 bits)
+
+    Se guardan en un JSON para no repetir tras un reinicio del backend
+    pruebas que ya sabemos que fallan.
+    """
+
+    def __init__(self, path: str = CAPABILITIES_FILE):
+        self.path = path
+        self._records: dict[str, dict] = {}
+        self._loaded = False
+
+    def load(self):
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self._records = {ip: rec for ip, rec in data.items() if isinstance(rec, dict)}
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._records, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"No se pudieron guardar las capacidades SNMP: {e}")
+
+    def get(self, ip: str) -> dict:
+        if not self._loaded:
+            self.load()
+        return dict(self._records.get(ip, {}))
+
+    def update(self, ip: str, record: dict):
+        """Guarda el registro de `ip`; solo escribe a disco si cambió."""
+        if not self._loaded:
+            self.load()
+        if self._records.get(ip) == record:
+            return
+        self._records[ip] = dict(record)
+        self.save()
+
+
+class SnapshotCache:
+    """
+    Último sondeo de cada dispositivo, con caducidad y desalojo LRU.
+
+    Un cliente que acepta datos de hasta `max_age` segundos recibe el
+    sondeo guardado en vez de provocar otro. Ningún sondeo se sirve pasado
+    `ttl`, y si hay más de `max_entries` se descarta el menos usado.
+    """
+
+    def __init__(self, ttl: float = SNAPSHOT_TTL_S, max_entries: int = SNAPSHOT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+
+    def get(self, key: tuple, max_age: float) -> dict | None:
+        """
+        Devuelve {'data', 'timestamp', 'age'} si hay un sondeo con una
+        antigüedad de `max_age` segundos como mucho.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        age = time.monotonic() - entry["sampled"]
+        if age > self.ttl:
+            del self._entries[key]
+            return None
+        if age > max_age:
+            return None
+
+        self._entries.move_to_end(key)
+        return {"data": entry["data"], "timestamp": entry["timestamp"], "age": age}
+
+    def put(self, key: tuple, data: dict) -> dict:
+        entry = {
+            "data": data,
+            "timestamp": time.time(),
+            "sampled": time.monotonic(),
+        }
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return {"data": data, "timestamp": entry["timestamp"], "age": 0.0}
+
+    def clear(self):
+        self._entries.clear()
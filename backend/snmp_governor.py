@@ -0,0 +1,397 @@
+# snmp_governor.py
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+# PDUs SNMP en vuelo como máximo en todo el proceso y por agente.
+# Se pueden cambiar con las variables de entorno del mismo nombre.
+SNMP_MAX_IN_FLIGHT = int(os.environ.get("SNMP_MAX_IN_FLIGHT", 64))
+SNMP_MAX_IN_FLIGHT_PER_HOST = int(os.environ.get("SNMP_MAX_IN_FLIGHT_PER_HOST", 4))
+
+# Timeout de cada PDU a partir del RTT medido (RFC 6298): valor inicial
+# para un host sin medidas, mínimo y máximo (segundos)
+RTO_INITIAL_S = 1.0
+RTO_MIN_S = 0.2
+RTO_MAX_S = 3.0
+# Los timeouts se redondean hacia arriba a estos escalones porque pysnmp
+# configura un destino distinto por cada combinación de timeout/reintentos
+RTO_STEPS_S = (0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0)
+
+# Reintentos por PDU, y reintentos y segundos totales que puede gastar
+# un sondeo
+SNMP_RETRIES = 2
+POLL_RETRY_BUDGET = 3
+POLL_TIME_BUDGET_S = 8.0
+
+# Circuit breaker: sondeos seguidos sin respuesta antes de dejar de
+# consultar un host, y espera antes de volver a probarlo (se duplica en
+# cada nuevo fallo hasta el máximo)
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_BACKOFF_S = 60
+CIRCUIT_MAX_BACKOFF_S = 900
+
+# Hosts que se sondean a la vez en un barrido (ventana AIMD): valor
+# inicial, límites y umbral hasta el que se crece rápido (slow start)
+SWEEP_INITIAL_CONCURRENCY = 4
+SWEEP_MIN_CONCURRENCY = 1
+SWEEP_MAX_CONCURRENCY = 256
+SWEEP_SLOW_START_THRESHOLD = 64
+# Factor por el que se multiplica la ventana al detectar pérdidas
+SWEEP_DECREASE_FACTOR = 0.5
+
+
+class RequestGovernor:
+    """
+    Limita los PDUs SNMP que hay en vuelo a la vez.
+
+    Un barrido lanza a la vez todos los hosts y cada host varias
+    consultas; sin límite se satura el enlace y los agentes descartan
+    paquetes, que acaban en reintentos y timeouts. Cada petición pide un
+    hueco con slot(host): espera si ya hay `max_in_flight` PDUs en total o
+    `max_per_host` contra ese agente.
+
+    stats() devuelve las métricas de saturación: cuántas peticiones
+    tuvieron que esperar y cuánto tiempo.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = SNMP_MAX_IN_FLIGHT,
+        max_per_host: int = SNMP_MAX_IN_FLIGHT_PER_HOST,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_per_host = max(1, max_per_host)
+        self._cond: asyncio.Condition | None = None
+        self._in_flight = 0
+        self._per_host: dict[str, int] = {}
+        self._waiting = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._waited = 0
+        self._wait_time = 0.0
+
+    def _condition(self) -> asyncio.Condition:
+        # Se crea dentro del bucle de eventos que la usa
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _full(self, host: str) -> bool:
+        return (
+            self._in_flight >= self.max_in_flight
+            or self._per_host.get(host, 0) >= self.max_per_host
+        )
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        cond = self._condition()
+        async with cond:
+            self._requests += 1
+            if self._full(host):
+                self._waited += 1
+                self._waiting += 1
+                start = time.monotonic()
+                try:
+                    await cond.wait_for(lambda: not self._full(host))
+                finally:
+                    self._waiting -= 1
+                    self._wait_time += time.monotonic() - start
+            self._in_flight += 1
+            self._per_host[host] = self._per_host.get(host, 0) + 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+        try:
+            yield
+        finally:
+            async with cond:
+                self._in_flight -= 1
+                self._per_host[host] -= 1
+                if not self._per_host[host]:
+                    del self._per_host[host]
+                cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_per_host": self.max_per_host,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight,
+            "waiting": self._waiting,
+            "busy_hosts": len(self._per_host),
+            "requests": self._requests,
+            "waited": self._waited,
+            "wait_ratio": self._waited / self._requests if self._requests else 0.0,
+            "avg_wait_ms": self._wait_time / self._waited * 1000 if self._waited else 0.0,
+        }
+
+
+class AimdLimiter:
+    """
+    Concurrencia de barridos que se ajusta sola, como la ventana de
+    congestión de TCP.
+
+    Cada host sondeado es un "paquete": si responde limpio la ventana
+    crece (se duplica por ronda hasta el umbral y luego +1 por ronda), y
+    si hay timeouts la ventana se multiplica por `decrease` y el umbral
+    baja a ese valor. Las pérdidas de hosts lanzados antes del último
+    recorte no vuelven a recortar, así una misma racha de pérdidas solo
+    cuenta una vez.
+
+    Uso:
+        token = await limiter.acquire()
+        try:
+            ...
+        finally:
+            await limiter.release(token, ok)   # True limpio, False pérdida, None neutro
+    """
+
+    def __init__(
+        self,
+        initial: int = SWEEP_INITIAL_CONCURRENCY,
+        minimum: int = SWEEP_MIN_CONCURRENCY,
+        maximum: int = SWEEP_MAX_CONCURRENCY,
+        threshold: int = SWEEP_SLOW_START_THRESHOLD,
+        decrease: float = SWEEP_DECREASE_FACTOR,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.window = float(min(max(initial, self.minimum), self.maximum))
+        self.threshold = float(threshold)
+        self.decrease = decrease
+        self._cond: asyncio.Condition | None = None
+        self._active = 0
+        self._epoch = 0
+        self._clean = 0
+        self._losses = 0
+        self._cuts = 0
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> int:
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self._active < int(self.window))
+            self._active += 1
+            return self._epoch
+
+    async def release(self, token: int, ok: bool | None):
+        cond = self._condition()
+        async with cond:
+            self._active -= 1
+
+            if ok is True:
+                self._clean += 1
+                if self.window < self.threshold:
+                    self.window += 1
+                else:
+                    self.window += 1 / self.window
+                self.window = min(self.window, self.maximum)
+            elif ok is False:
+                self._losses += 1
+                if token == self._epoch:
+                    self._epoch += 1
+                    self._cuts += 1
+                    self.window = max(self.window * self.decrease, self.minimum)
+                    self.threshold = max(self.window, self.minimum)
+
+            cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "window": round(self.window, 2),
+            "threshold": round(self.threshold, 2),
+            "active": self._active,
+            "clean": self._clean,
+            "losses": self._losses,
+            "cuts": self._cuts,
+        }
+
+
+class HostRtt:
+    """
+    RTT suavizado de un host (SRTT/RTTVAR, como TCP) y el timeout que se
+    deduce de él. Solo se miden respuestas al primer intento (algoritmo de
+    Karn); cada timeout duplica el RTO hasta que llegue una medida nueva.
+    """
+
+    def __init__(self):
+        self.srtt: float | None = None
+        self.rttvar: float | None = None
+        self.rto = RTO_INITIAL_S
+        self.samples = 0
+        self.timeouts = 0
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MIN_S), RTO_MAX_S)
+        self.samples += 1
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, RTO_MAX_S)
+        self.timeouts += 1
+
+    def timeout(self) -> float:
+        """RTO redondeado al escalón de RTO_STEPS_S inmediatamente superior."""
+        for step in RTO_STEPS_S:
+            if step >= self.rto:
+                return step
+        return RTO_STEPS_S[-1]
+
+    def stats(self) -> dict:
+        return {
+            "srtt_ms": self.srtt * 1000 if self.srtt is not None else None,
+            "rttvar_ms": self.rttvar * 1000 if self.rttvar is not None else None,
+            "rto_ms": self.rto * 1000,
+            "samples": self.samples,
+            "timeouts": self.timeouts,
+        }
+
+
+class RttTable:
+    """HostRtt de cada host, por IP."""
+
+    def __init__(self):
+        self._hosts: dict[str, HostRtt] = {}
+
+    def get(self, host: str) -> HostRtt:
+        rtt = self._hosts.get(host)
+        if rtt is None:
+            rtt = self._hosts[host] = HostRtt()
+        return rtt
+
+    def stats(self) -> dict:
+        return {host: rtt.stats() for host, rtt in self._hosts.items()}
+
+
+class RetryBudget:
+    """
+    Lo que puede gastar un sondeo entre todos sus PDUs: `retries`
+    reintentos y `seconds` segundos. Sin reintentos cada PDU se envía una
+    sola vez, y pasado el tiempo ya no se envía nada, así un host lento o
+    con pérdidas cuesta como mucho un tiempo acotado.
+
+    `replies` cuenta los PDUs que tuvieron respuesta (aunque fuera un
+    error), para distinguir un host mudo de uno lento.
+    """
+
+    def __init__(self, retries: int = POLL_RETRY_BUDGET, seconds: float = POLL_TIME_BUDGET_S):
+        self.remaining = retries
+        self.deadline = time.monotonic() + seconds
+        self.replies = 0
+
+    def take(self) -> bool:
+        if self.remaining <= 0 or self.expired():
+            return False
+        self.remaining -= 1
+        return True
+
+    def time_left(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.time_left() <= 0
+
+    def clamp(self, timeout: float) -> float:
+        """Escalón de RTO_STEPS_S más alto que cabe en el tiempo que queda."""
+        left = self.time_left()
+        if timeout <= left:
+            return timeout
+        fitting = [step for step in RTO_STEPS_S if step <= left]
+        return fitting[-1] if fitting else RTO_STEPS_S[0]
+
+
+class CircuitOpenError(Exception):
+    """El host tiene el circuito abierto y no se ha consultado."""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"circuit-open: {host} (reintento en {retry_in:.0f} s)")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Deja de consultar los hosts que no responden por SNMP.
+
+    Muchos hosts que nmap ve activos no tienen agente SNMP (teléfonos,
+    impresoras...) y cada sondeo gastaría el presupuesto de timeouts
+    entero. Tras `threshold` sondeos seguidos sin respuesta el circuito
+    del host se abre y check() devuelve "open" durante `backoff`
+    segundos. Pasado ese tiempo devuelve "probe" una sola vez: quien lo
+    recibe hace un GET barato y llama a record() con el resultado. Si
+    falla, el circuito vuelve a abrirse con el doble de espera.
+    """
+
+    def __init__(
+        self,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        backoff: float = CIRCUIT_BACKOFF_S,
+        max_backoff: float = CIRCUIT_MAX_BACKOFF_S,
+    ):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._hosts: dict[str, dict] = {}
+
+    def check(self, host: str) -> str:
+        """"closed" (consultar), "probe" (probar con un GET) u "open" (omitir)."""
+        state = self._hosts.get(host)
+        if state is None or state["open_until"] is None:
+            return "closed"
+        if state["probing"] or time.monotonic() < state["open_until"]:
+            return "open"
+        state["probing"] = True
+        return "probe"
+
+    def retry_in(self, host: str) -> float:
+        state = self._hosts.get(host)
+        if state is None or state["open_until"] is None:
+            return 0.0
+        return max(state["open_until"] - time.monotonic(), 0.0)
+
+    def record(self, host: str, ok: bool):
+        if ok:
+            self._hosts.pop(host, None)
+            return
+
+        state = self._hosts.setdefault(
+            host, {"failures": 0, "open_until": None, "backoff": 0.0, "probing": False}
+        )
+        state["failures"] += 1
+        state["probing"] = False
+        if state["open_until"] is not None:
+            # Falló la prueba: otra espera, el doble de larga
+            state["backoff"] = min(state["backoff"] * 2, self.max_backoff)
+        elif state["failures"] >= self.threshold:
+            state["backoff"] = self.backoff
+        else:
+            return
+        state["open_until"] = time.monotonic() + state["backoff"]
+
+    def stats(self) -> dict:
+        return {
+            host: {
+                "failures": state["failures"],
+                "open": state["open_until"] is not None,
+                "retry_in": self.retry_in(host),
+            }
+            for host, state in self._hosts.items()
+        }
+
+
+# Instancias globales: snmp_query usa request_governor y rtt_table en cada
+# PDU que envía y main.py comparte sweep_limiter entre todos los barridos, así lo
+# aprendido en uno vale para el siguiente
+request_governor = RequestGovernor()
+rtt_table = RttTable()
+circuit_breaker = CircuitBreaker()
+sweep_limiter = AimdLimiter()
@@ -1,6 +1,7 @@
 # snmp_query.py
 import asyncio
 import re
+import time
 import xml.etree.ElementTree as ET
 
 import pysnmp as snmp
@@ -8,10 +9,38 @@ from pysnmp.hlapi.v3arch.asyncio import (
     SnmpEngine,
     UdpTransportTarget,
     CommunityData,
+    UsmUserData,
     ContextData,
     ObjectType,
     ObjectIdentity,
+    EndOfMibView,
     get_cmd,
+    next_cmd,
+    bulk_cmd,
+    USM_AUTH_HMAC96_MD5,
+    USM_AUTH_HMAC96_SHA,
+    USM_AUTH_HMAC192_SHA256,
+    USM_AUTH_HMAC384_SHA512,
+    USM_PRIV_CBC56_DES,
+    USM_PRIV_CFB128_AES,
+    USM_PRIV_CFB256_AES,
+)
+from pysnmp.proto import errind
+from pysnmp.proto.rfc1902 import ObjectName
+
+from history import history_store, extract_metrics
+from archive import metric_archive
+from history_db import history_db
+from snmp_cache import LayoutCache, CapabilityStore, SnapshotCache, is_missing, is_timeout
+from snmp_governor import (
+    request_governor,
+    rtt_table,
+    circuit_breaker,
+    CircuitOpenError,
+    RetryBudget,
+    RTO_INITIAL_S,
+    SNMP_RETRIES,
+    POLL_TIME_BUDGET_S,
 )
 
 print("Usando pysnmp", snmp.__version__)
@@ -26,16 +55,642 @@ SCALAR_OIDS = {
     "hrMemorySize": "1.3.6.1.2.1.25.2.2.0",
 }
 
-# Índices candidatos para hrProcessorLoad.<idx>
-CPU_INDEX_CANDIDATES = [196608] + list(range(1, 33))
+# sysUpTime del agente; se pide junto a los escalares para detectar reinicios
+SYS_UPTIME = "1.3.6.1.2.1.1.3.0"
+
+# Columnas de las tablas que se recorren con GETNEXT/GETBULK
+HR_PROCESSOR_LOAD = "1.3.6.1.2.1.25.3.3.1.2"
+HR_DEVICE_DESCR = "1.3.6.1.2.1.25.3.2.1.3"
+HR_STORAGE_TYPE = "1.3.6.1.2.1.25.2.3.1.2"
+IF_DESCR = "1.3.6.1.2.1.2.2.1.2"
+IF_OPER_STATUS = "1.3.6.1.2.1.2.2.1.8"
+
+# Filas por columna que se piden en cada GETBULK
+BULK_MAX_REPETITIONS = 25
+
+# OIDs que se empaquetan como máximo en un mismo GET; si el agente
+# responde tooBig el lote se parte en dos
+MAX_VARBINDS_PER_PDU = 24
+
+# Sondeo de índices de hrProcessorLoad para agentes que no dejan recorrer
+# la tabla: los índices suelen empezar en 196608 (Net-SNMP, Windows) o en 1.
+# Se piden ventanas de CPU_PROBE_WINDOW índices por GET, con como mucho
+# CPU_PROBE_CONCURRENCY GETs en vuelo.
+CPU_INDEX_BASES = (196608, 1)
+CPU_PROBE_WINDOW = 16
+CPU_PROBE_CONCURRENCY = 4
+
+# Secciones de un sondeo (una por recolector); con deadline se indica
+# cuáles quedaron incompletas
+POLL_SECTIONS = ("scalars", "cpu", "storage", "interfaces")
 
 # Tipos de hrStorageType
 HR_STORAGE_RAM = "1.3.6.1.2.1.25.2.1.2"
 HR_STORAGE_FIXED_DISK = "1.3.6.1.2.1.25.2.1.4"
 
+SNMP_PORT = 161
+
+# Versiones de SNMP soportadas -> mpModel de pysnmp. La "3" usa USM.
+SNMP_VERSIONS = {"1": 0, "2c": 1, "3": 3}
+DEFAULT_SNMP_VERSION = "2c"
+
+AUTH_PROTOCOLS = {
+    "MD5": USM_AUTH_HMAC96_MD5,
+    "SHA": USM_AUTH_HMAC96_SHA,
+    "SHA256": USM_AUTH_HMAC192_SHA256,
+    "SHA512": USM_AUTH_HMAC384_SHA512,
+}
+PRIV_PROTOCOLS = {
+    "DES": USM_PRIV_CBC56_DES,
+    "AES": USM_PRIV_CFB128_AES,
+    "AES256": USM_PRIV_CFB256_AES,
+}
+
+
+def build_auth_data(
+    community_str: str = "public",
+    version: str = DEFAULT_SNMP_VERSION,
+    usm: dict | None = None,
+) -> CommunityData | UsmUserData:
+    """
+    Credenciales de pysnmp según la versión del dispositivo.
+
+    - "1" / "2c": CommunityData con la comunidad indicada
+    - "3": UsmUserData a partir de `usm`, un dict con las claves
+      user, auth_key, priv_key, auth_protocol ("SHA" por defecto) y
+      priv_protocol ("AES" por defecto)
+    """
+    if version not in SNMP_VERSIONS:
+        raise ValueError(
+            f"Versión SNMP no válida: {version!r}. Usa una de {', '.join(SNMP_VERSIONS)}."
+        )
+
+    if version != "3":
+        return CommunityData(community_str, mpModel=SNMP_VERSIONS[version])
+
+    if not usm or not usm.get("user"):
+        raise ValueError("SNMPv3 necesita al menos un usuario (usm['user']).")
+
+    auth_key = usm.get("auth_key")
+    priv_key = usm.get("priv_key")
+    auth_name = usm.get("auth_protocol") or "SHA"
+    priv_name = usm.get("priv_protocol") or "AES"
+    if auth_name not in AUTH_PROTOCOLS:
+        raise ValueError(f"Protocolo de autenticación no válido: {auth_name!r}")
+    if priv_name not in PRIV_PROTOCOLS:
+        raise ValueError(f"Protocolo de privacidad no válido: {priv_name!r}")
+    # Niveles válidos: noAuthNoPriv, authNoPriv y authPriv (RFC 3414)
+    if priv_key and not auth_key:
+        raise ValueError("SNMPv3 con privacidad necesita también autenticación (auth_key).")
+    for name, key in (("auth_key", auth_key), ("priv_key", priv_key)):
+        if key and len(key) < 8:
+            raise ValueError(f"La clave SNMPv3 {name} debe tener al menos 8 caracteres.")
+
+    return UsmUserData(
+        usm["user"],
+        authKey=auth_key,
+        privKey=priv_key,
+        authProtocol=AUTH_PROTOCOLS[auth_name] if auth_key else None,
+        privProtocol=PRIV_PROTOCOLS[priv_name] if priv_key else None,
+    )
+
+
+class SnmpManager:
+    """
+    Motor SNMP compartido por todo el proceso.
+
+    Crear un SnmpEngine (y su dispatcher) en cada consulta es caro, así que
+    se crea uno solo al arrancar FastAPI y se reutiliza en todos los
+    endpoints. Los UdpTransportTarget se guardan en un pool por host y
+    timeout para no resolver la dirección en cada sondeo. Se crean sin
+    reintentos: los reintentos los hace send_pdu con el timeout adaptado
+    al RTT del host.
+    """
+
+    def __init__(self):
+        self.engine: SnmpEngine | None = None
+        self.targets: dict[tuple[str, int, float], UdpTransportTarget] = {}
+        self._targets_lock = asyncio.Lock()
+
+    def start(self) -> SnmpEngine:
+        if self.engine is None:
+            self.engine = SnmpEngine()
+        return self.engine
+
+    async def get_target(
+        self, ip: str, port: int = SNMP_PORT, timeout: float = RTO_INITIAL_S
+    ) -> UdpTransportTarget:
+        key = (ip, port, timeout)
+        target = self.targets.get(key)
+        if target is not None:
+            return target
+
+        async with self._targets_lock:
+            target = self.targets.get(key)
+            if target is None:
+                target = await UdpTransportTarget.create(
+                    (ip, port), timeout=timeout, retries=0
+                )
+                self.targets[key] = target
+        return target
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close_dispatcher()
+        self.engine = None
+        self.targets.clear()
+
+
+class SingleFlight:
+    """
+    Agrupa peticiones concurrentes iguales en una sola ejecución.
+
+    Si llegan varias consultas con la misma clave mientras una está en
+    curso, todas esperan el mismo resultado en vez de lanzar otra. La
+    ejecución va en su propia tarea, así que si un cliente se desconecta
+    no se cancela para el resto.
+    """
+
+    def __init__(self):
+        self._inflight: dict[tuple, asyncio.Task] = {}
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita el aviso de excepción no recuperada si nadie la esperó
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: tuple, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+
+# Instancia global; main.py la arranca y la cierra en el lifespan de FastAPI
+snmp_manager = SnmpManager()
+
+# Sondeos en curso, para no consultar dos veces el mismo equipo a la vez
+poll_flights = SingleFlight()
+
+# Último sondeo de cada dispositivo, para clientes que aceptan datos recientes
+snapshot_cache = SnapshotCache()
+
+# Estructura descubierta de cada dispositivo (índices y plan de OIDs)
+layout_cache = LayoutCache()
+
+# Capacidades de protocolo de cada dispositivo (persisten en disco)
+capability_store = CapabilityStore()
+
+
+async def send_pdu(target: UdpTransportTarget, request, budget: RetryBudget | None = None):
+    """
+    Envía un PDU con request(target) y devuelve su resultado
+    (errorIndication, errorStatus, errorIndex, varBinds).
+
+    El timeout sale del RTT medido del host y se reintenta hasta
+    SNMP_RETRIES veces, duplicando el timeout, mientras quede `budget`.
+    Solo las respuestas al primer intento alimentan el RTT. Si al sondeo
+    ya no le queda tiempo no se envía nada y se devuelve un timeout; la
+    espera por un hueco del gobernador y la propia petición tampoco pasan
+    del plazo de `budget`.
+    """
+    host, port = target.transport_address
+    rtt = rtt_table.get(host)
+    retries = SNMP_RETRIES
+
+    while True:
+        timeout = rtt.timeout()
+        if budget is not None:
+            if budget.expired():
+                return errind.requestTimedOut, 0, 0, []
+            timeout = budget.clamp(timeout)
+
+        attempt_target = await snmp_manager.get_target(host, port, timeout)
+
+        async def attempt():
+            async with request_governor.slot(host):
+                # Puede haberse acabado el plazo esperando el hueco
+                if budget is not None and budget.expired():
+                    return (errind.requestTimedOut, 0, 0, []), 0.0
+                start = time.monotonic()
+                result = await request(attempt_target)
+                return result, time.monotonic() - start
+
+        if budget is None:
+            result, elapsed = await attempt()
+        else:
+            # El timeout de pysnmp va en escalones (RTO_STEPS_S) y puede
+            # pasarse de lo que queda; el plazo se corta aquí
+            try:
+                result, elapsed = await asyncio.wait_for(attempt(), budget.time_left())
+            except TimeoutError:
+                return errind.requestTimedOut, 0, 0, []
+
+        if not isinstance(result[0], errind.RequestTimedOut):
+            if retries == SNMP_RETRIES:
+                rtt.sample(elapsed)
+            if budget is not None:
+                budget.replies += 1
+            return result
+
+        rtt.backoff()
+        if retries <= 0 or (budget is not None and not budget.take()):
+            return result
+        retries -= 1
+
+
+def _row_index(base: ObjectName, oid: ObjectName):
+    # Las tablas que recorremos tienen índice entero; si no, se usa "a.b.c"
+    suffix = oid[len(base):]
+    if len(suffix) == 1:
+        return int(suffix[0])
+    return ".".join(str(x) for x in suffix)
+
+
+async def walk_columns(
+    snmpEngine: SnmpEngine,
+    community: CommunityData | UsmUserData,
+    target: UdpTransportTarget,
+    columns: dict[str, str],
+    max_repetitions: int = BULK_MAX_REPETITIONS,
+    caps: dict | None = None,
+    budget: RetryBudget | None = None,
+) -> tuple[dict[str, dict], bool]:
+    """
+    Recorre varias columnas de tabla a la vez, todas en el mismo PDU.
+    Usa GETBULK si la versión lo permite (v2c/v3) y GETNEXT en SNMPv1.
+
+    `caps` es el registro de capacidades del dispositivo: si indica
+    bulk = False se usa GETNEXT directamente, y si el agente rechaza el
+    GETBULK se anota ahí y se sigue con GETNEXT.
+
+    Cada PDU pasa por send_pdu (límites de concurrencia, timeout y
+    reintentos según el RTT del host, y `budget` de reintentos).
+
+    Devuelve ({nombre_columna: {índice: varBind}}, completo) con las filas
+    en orden. Si el agente falla a mitad del recorrido se devuelve lo
+    obtenido hasta ese momento y completo = False.
+    """
+    bases = {name: ObjectName(oid) for name, oid in columns.items()}
+    cursors = dict(bases)
+    rows: dict[str, dict] = {name: {} for name in columns}
+    caps = caps if caps is not None else {}
+    # SNMPv1 no tiene GETBULK
+    use_bulk = community.message_processing_model > 0 and caps.get("bulk", True)
+
+    while cursors:
+        names = list(cursors)
+        request = [ObjectType(ObjectIdentity(cursors[name])) for name in names]
+
+        if use_bulk:
+            def send(target):
+                return bulk_cmd(
+                    snmpEngine,
+                    community,
+                    target,
+                    ContextData(),
+                    0,
+                    max_repetitions,
+                    *request,
+                    lookupMib=False,
+                )
+        else:
+            def send(target):
+                return next_cmd(
+                    snmpEngine,
+                    community,
+                    target,
+                    ContextData(),
+                    *request,
+                    lookupMib=False,
+                )
+
+        errorIndication, errorStatus, errorIndex, varBinds = await send_pdu(
+            target, send, budget
+        )
+
+        if errorIndication:
+            return rows, False
+
+        if errorStatus:
+            # Agente que no entiende GETBULK: se recuerda y se sigue con GETNEXT
+            if use_bulk and not any(rows.values()):
+                caps["bulk"] = False
+                use_bulk = False
+                continue
+
+            # SNMPv1 responde noSuchName cuando una columna llega al final
+            # del MIB; se descarta esa columna y se sigue con el resto
+            bad = int(errorIndex) - 1
+            if not use_bulk and 0 <= bad < len(names):
+                del cursors[names[bad]]
+                continue
+            return rows, False
+
+        if not varBinds:
+            break
+
+        if use_bulk:
+            caps["bulk"] = True
+
+        finished = set()
+        for pos, vb in enumerate(varBinds):
+            name = names[pos % len(names)]
+            if name in finished:
+                continue
+
+            oid, value = vb[0], vb[1]
+            if (
+                isinstance(value, EndOfMibView)
+                or not bases[name].isPrefixOf(oid)
+                or oid <= cursors[name]
+            ):
+                finished.add(name)
+                continue
+
+            rows[name][_row_index(bases[name], oid)] = vb
+            cursors[name] = oid
+
+        for name in finished:
+            del cursors[name]
+
+    return rows, True
+
+
+async def get_many(
+    snmpEngine: SnmpEngine,
+    community: CommunityData | UsmUserData,
+    target: UdpTransportTarget,
+    oids: dict[str, str],
+    max_varbinds: int = MAX_VARBINDS_PER_PDU,
+    caps: dict | None = None,
+    budget: RetryBudget | None = None,
+) -> dict[str, dict]:
+    """
+    GET de varios OIDs empaquetados en el menor número de PDUs posible.
+
+    Recibe {clave: oid} y devuelve {clave: {'OID': ..., 'Valor': ...}} con
+    el mismo formato que get_snmp_data. Los errores se asignan a cada clave:
+    - noSuchObject / noSuchInstance (v2c) quedan en el 'Valor' de su clave
+    - noSuchName (v1) marca solo el OID culpable y se reintenta el resto
+    - tooBig parte el lote en dos mitades
+
+    Con `caps` se usa y se aprende el máximo de OIDs por PDU que acepta el
+    agente (caps["max_varbinds"]), para no repetir el tooBig.
+    """
+    results: dict[str, dict] = {}
+    caps = caps if caps is not None else {}
+    max_varbinds = min(max_varbinds, caps.get("max_varbinds", max_varbinds))
+
+    async def send(keys: list[str]):
+        if not keys:
+            return
+
+        try:
+            errorIndication, errorStatus, errorIndex, varBinds = await send_pdu(
+                target,
+                lambda target: get_cmd(
+                    snmpEngine,
+                    community,
+                    target,
+                    ContextData(),
+                    *[ObjectType(ObjectIdentity(oids[key])) for key in keys],
+                    lookupMib=False,
+                ),
+                budget,
+            )
+        except Exception as e:
+            for key in keys:
+                results[key] = {"OID": oids[key], "Valor": f"Exception: {e}"}
+            return
+
+        if errorIndication:
+            for key in keys:
+                results[key] = {"OID": oids[key], "Valor": str(errorIndication)}
+            return
+
+        if errorStatus:
+            status = errorStatus.prettyPrint()
+
+            if status == "tooBig" and len(keys) > 1:
+                half = len(keys) // 2
+                caps["max_varbinds"] = min(caps.get("max_varbinds", half), half)
+                await asyncio.gather(send(keys[:half]), send(keys[half:]))
+                return
+
+            bad = int(errorIndex) - 1
+            if 0 <= bad < len(keys):
+                results[keys[bad]] = {
+                    "OID": oids[keys[bad]],
+                    "Valor": f"Error: {status}",
+                }
+                await send(keys[:bad] + keys[bad + 1:])
+                return
+
+            for key in keys:
+                results[key] = {"OID": oids[key], "Valor": f"Error: {status}"}
+            return
+
+        for key, vb in zip(keys, varBinds):
+            results[key] = {
+                "OID": vb[0].prettyPrint(),
+                "Valor": vb[1].prettyPrint(),
+            }
+
+    keys = list(oids)
+    await asyncio.gather(*[
+        send(keys[i:i + max_varbinds])
+        for i in range(0, len(keys), max_varbinds)
+    ])
+
+    # Devolver en el orden en que se pidieron
+    return {key: results[key] for key in keys if key in results}
+
+
+async def probe_processor_loads(
+    snmpEngine: SnmpEngine,
+    community: CommunityData | UsmUserData,
+    target: UdpTransportTarget,
+    caps: dict | None = None,
+    budget: RetryBudget | None = None,
+    window: int = CPU_PROBE_WINDOW,
+    concurrency: int = CPU_PROBE_CONCURRENCY,
+) -> dict[int, dict]:
+    """
+    Busca los núcleos preguntando directamente por hrProcessorLoad.<idx>
+    a partir de cada índice de CPU_INDEX_BASES.
+
+    Los índices de los núcleos son consecutivos, así que cada base se
+    explora por ventanas de `window` índices (una ventana = un GET) y se
+    deja de buscar en cuanto una ventana no sale completa. Empieza con una
+    ventana y dobla las que lanza en paralelo en cada ronda, sin pasar de
+    `concurrency` GETs en vuelo en total: un equipo normal se resuelve con
+    un GET por base y uno con cientos de núcleos en pocas rondas.
+
+    Devuelve {índice: {'OID', 'Valor'}} con los índices que existen.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    found: dict[int, dict] = {}
+
+    async def probe_window(start: int) -> dict[int, dict]:
+        oids = {
+            str(idx): f"{HR_PROCESSOR_LOAD}.{idx}"
+            for idx in range(start, start + window)
+        }
+        async with semaphore:
+            results = await get_many(
+                snmpEngine, community, target, oids,
+                max_varbinds=window, caps=caps, budget=budget,
+            )
+        return {
+            int(key): entry
+            for key, entry in results.items()
+            if not is_missing(entry) and entry["Valor"].isdigit()
+        }
+
+    async def scan(base: int):
+        start, batch = base, 1
+        while True:
+            starts = [start + i * window for i in range(batch)]
+            windows = await asyncio.gather(*[probe_window(s) for s in starts])
+            for hits in windows:
+                found.update(hits)
+                if len(hits) < window:
+                    # Hueco: la tabla ya está resuelta para esta base
+                    return
+            start = starts[-1] + window
+            batch = min(batch * 2, concurrency)
+
+    await asyncio.gather(*[scan(base) for base in CPU_INDEX_BASES])
+    return dict(sorted(found.items()))
+
+
+async def detect_version(
+    snmpEngine: SnmpEngine,
+    target: UdpTransportTarget,
+    community_str: str,
+    budget: RetryBudget | None = None,
+) -> str | None:
+    # Primer contacto: se prueba v2c y, si no responde, v1
+    for version in ("2c", "1"):
+        community = build_auth_data(community_str, version)
+        probe = await get_many(
+            snmpEngine, community, target, {"_sysUpTime": SYS_UPTIME},
+            budget=budget,
+        )
+        if probe.get("_sysUpTime", {}).get("Valor", "").isdigit():
+            return version
+    return None
 
-async def get_snmp_data(ip: str, community_str: str = "public") -> dict:
+
+async def get_snmp_data(
+    ip: str,
+    community_str: str | None = None,
+    version: str | None = None,
+    usm: dict | None = None,
+    max_repetitions: int = BULK_MAX_REPETITIONS,
+) -> dict:
+    """
+    Consulta un dispositivo (ver poll_device) y devuelve solo los datos.
     """
+    snapshot = await get_snmp_snapshot(ip, community_str, version, usm, max_repetitions)
+    return snapshot["data"]
+
+
+async def get_snmp_snapshot(
+    ip: str,
+    community_str: str | None = None,
+    version: str | None = None,
+    usm: dict | None = None,
+    max_repetitions: int = BULK_MAX_REPETITIONS,
+    max_age: float | None = None,
+    timeout: float | None = None,
+) -> dict:
+    """
+    Devuelve {'data': ..., 'timestamp': epoch del sondeo, 'age': segundos,
+    'sections': {sección: {'complete': bool}}}.
+
+    Con `max_age` se acepta un sondeo guardado de como mucho esa
+    antigüedad. Si hay que sondear, las llamadas simultáneas para la misma
+    IP, comunidad y perfil (versión, usuario v3, max_repetitions)
+    comparten un único sondeo, cuyo resultado queda en snapshot_cache.
+
+    Con `timeout` (segundos) el sondeo se corta en ese plazo y devuelve lo
+    recogido hasta entonces; las secciones sin terminar salen con
+    complete = False y ese sondeo parcial no se guarda en la caché.
+    """
+    profile = (version, (usm or {}).get("user"), max_repetitions)
+    key = (ip, community_str, profile)
+
+    snapshot = None
+    if max_age:
+        snapshot = snapshot_cache.get(key, max_age)
+
+    if snapshot is None:
+        async def poll_and_store():
+            data, sections = await poll_device(
+                ip, community_str, version, usm, max_repetitions, timeout
+            )
+            if all(section["complete"] for section in sections.values()):
+                stored = snapshot_cache.put(key, data)
+            else:
+                stored = {"data": data, "timestamp": time.time(), "age": 0.0}
+            metrics = extract_metrics(data)
+            if metrics:
+                history_store.append(ip, stored["timestamp"], metrics)
+                metric_archive.append(ip, stored["timestamp"], metrics)
+                history_db.append(ip, stored["timestamp"], metrics)
+            return {**stored, "sections": sections}
+
+        # Un sondeo con plazo solo se comparte con otros del mismo plazo
+        snapshot = await poll_flights.do((*key, timeout), poll_and_store)
+
+    # Copia para que ningún llamante modifique lo que reciben los demás
+    sections = snapshot.get("sections") or {
+        name: {"complete": True} for name in POLL_SECTIONS
+    }
+    return {
+        "data": {name: dict(entry) for name, entry in snapshot["data"].items()},
+        "timestamp": snapshot["timestamp"],
+        "age": snapshot["age"],
+        "sections": {name: dict(section) for name, section in sections.items()},
+    }
+
+
+async def poll_device(
+    ip: str,
+    community_str: str | None = None,
+    version: str | None = None,
+    usm: dict | None = None,
+    max_repetitions: int = BULK_MAX_REPETITIONS,
+    timeout: float | None = None,
+) -> tuple[dict, dict]:
+    """
+    Consulta un dispositivo con la versión de SNMP indicada ("1", "2c" o
+    "3"; ver build_auth_data). En v2c/v3 las tablas se recorren con
+    GETBULK pidiendo `max_repetitions` filas por columna.
+
+    Si no se indican versión o comunidad se usan las aprendidas para ese
+    dispositivo (capability_store); en el primer contacto se prueba v2c y
+    después v1, con la comunidad "public".
+
+    Si el host lleva varios sondeos sin responder (circuit_breaker) lanza
+    CircuitOpenError sin consultarlo.
+
+    `timeout` es el plazo total en segundos (POLL_TIME_BUDGET_S si no se
+    indica). Al cumplirse se cancelan los recolectores pendientes y se
+    devuelve lo que haya.
+
+    Devuelve (resultados, secciones), con secciones =
+    {'scalars' | 'cpu' | 'storage' | 'interfaces': {'complete': bool}}.
+
     Devuelve un dict con estructura:
     {
         'sysDescr': {'OID': '...', 'Valor': '...'},
@@ -50,156 +705,198 @@ async def get_snmp_data(ip: str, community_str: str = "public") -> dict:
     """
     snmp_results: dict[str, dict] = {}
 
-    snmpEngine = SnmpEngine()
-    target = await UdpTransportTarget.create((ip, 161))
-    community = CommunityData(community_str, mpModel=0)
-
-    async def do_get(oid: str):
-        iterator = get_cmd(
-            snmpEngine,
-            community,
-            target,
-            ContextData(),
-            ObjectType(ObjectIdentity(oid)),
-        )
-        return await iterator
+    # Si nadie arrancó el gestor (p. ej. uso fuera de FastAPI) se crea aquí
+    snmpEngine = snmp_manager.start()
+    target = await snmp_manager.get_target(ip)
+    # Reintentos y tiempo que puede gastar este sondeo entre todos sus PDUs
+    budget = RetryBudget(seconds=timeout if timeout is not None else POLL_TIME_BUDGET_S)
 
-    async def get_scalar(name: str, oid: str):
-        try:
-            errorIndication, errorStatus, errorIndex, varBinds = await do_get(oid)
+    # Host que lleva varios sondeos sin responder: se omite o, pasada la
+    # espera, se prueba con un GET antes de sondearlo entero
+    circuit = circuit_breaker.check(ip)
+    if circuit == "open":
+        raise CircuitOpenError(ip, circuit_breaker.retry_in(ip))
 
-            if errorIndication:
-                snmp_results[name] = {"OID": oid, "Valor": str(errorIndication)}
-                return
+    caps = capability_store.get(ip)
+    if community_str is None:
+        community_str = caps.get("community", "public")
+    if version is None:
+        version = caps.get("version")
+        # Lo aprendido en v3 solo sirve con credenciales USM; sin ellas se
+        # vuelve a detectar como en el primer contacto
+        if version == "3" and not usm:
+            version = None
 
-            if errorStatus:
-                snmp_results[name] = {
-                    "OID": oid,
-                    "Valor": f"Error: {errorStatus.prettyPrint()}",
-                }
-                return
+    if circuit == "probe":
+        # Un GET de sysUpTime sin reintentos; si no sabemos la versión se
+        # prueban v2c y v1 a la vez
+        candidates = [version] if version is not None else ["2c", "1"]
+        answered = False
+        try:
+            probes = await asyncio.gather(*[
+                get_many(
+                    snmpEngine,
+                    build_auth_data(community_str, candidate, usm),
+                    target,
+                    {"_sysUpTime": SYS_UPTIME},
+                    budget=RetryBudget(retries=0, seconds=budget.time_left()),
+                )
+                for candidate in candidates
+            ])
+            for candidate, probe in zip(candidates, probes):
+                if probe["_sysUpTime"]["Valor"].isdigit():
+                    version = candidate
+                    answered = True
+                    break
+        finally:
+            circuit_breaker.record(ip, answered)
+        if not answered:
+            raise CircuitOpenError(ip, circuit_breaker.retry_in(ip))
 
-            if varBinds:
-                vb = varBinds[0]
-                snmp_results[name] = {
-                    "OID": vb[0].prettyPrint(),
-                    "Valor": vb[1].prettyPrint(),
-                }
-        except Exception as e:
-            snmp_results[name] = {"OID": oid, "Valor": f"Exception: {e}"}
+    if version is None:
+        version = await detect_version(snmpEngine, target, community_str, budget)
+    if version is None:
+        version = DEFAULT_SNMP_VERSION
+    if caps.get("version") != version:
+        # Lo aprendido con otra versión (GETBULK, 64 bits...) no vale
+        caps = {}
 
-    async def get_cpu_info():
-        """
-        - Busca varios hrProcessorLoad.<idx>
-        - Guarda cada núcleo como hrProcessorLoad.<idx>
-        - Intenta obtener un buen nombre de CPU en hrDeviceDescr
-        """
-        cpu_load_base = "1.3.6.1.2.1.25.3.3.1.2"
-        cpu_descr_base = "1.3.6.1.2.1.25.3.2.1.3"
+    community = build_auth_data(community_str, version, usm)
 
-        first_index = None
+    async def do_get_many(oids: dict[str, str]) -> dict[str, dict]:
+        return await get_many(
+            snmpEngine, community, target, oids, caps=caps, budget=budget
+        )
 
-        # 1) Recoger hrProcessorLoad.<idx>
-        for idx in CPU_INDEX_CANDIDATES:
-            load_oid = f"{cpu_load_base}.{idx}"
-            errorIndication, errorStatus, errorIndex, varBinds = await do_get(load_oid)
+    def remember_caps(results: dict[str, dict]):
+        # Solo se aprende de un agente que ha respondido. Sin ninguna
+        # respuesta el host cuenta como fallo, salvo que lo cortara el
+        # `timeout` del llamante; si respondió algo pero se acabó el plazo
+        # no se sabe si falla
+        answered = results.get("_sysUpTime", {}).get("Valor", "").isdigit()
+        cut_short = budget.expired() and (timeout is not None or budget.replies)
+        if answered or not cut_short:
+            circuit_breaker.record(ip, answered)
+        if not answered:
+            return
+        caps["version"] = version
+        if version != "3":
+            caps["community"] = community_str
+        capability_store.update(ip, caps)
 
-            if errorIndication or errorStatus or not varBinds:
-                continue
+    # Sondeo normal: si ya conocemos la estructura basta un GET del plan
+    layout = layout_cache.get(ip)
+    if layout is not None:
+        fetched = await do_get_many(layout["plan"])
+        if layout_cache.validate(ip, fetched):
+            remember_caps(fetched)
+            snmp_results.update(layout["static"])
+            snmp_results.update(fetched)
+            return public_results(snmp_results), poll_sections(snmp_results)
 
-            vb = varBinds[0]
-            val_str = vb[1].prettyPrint()
-            if "No Such" in val_str:
-                continue
+    # Descubrimiento completo; de paso se construye el plan de OIDs hoja
+    plan: dict[str, str] = {}
+    expect: dict[str, str] = {}
+    # Secciones con algún recorrido de tabla a medias
+    incomplete: set[str] = set()
 
-            snmp_results[f"hrProcessorLoad.{idx}"] = {
-                "OID": vb[0].prettyPrint(),
-                "Valor": val_str,
-            }
+    async def get_scalars():
+        # Los escalares básicos viajan todos en un mismo PDU
+        oids = {**SCALAR_OIDS, "_sysUpTime": SYS_UPTIME}
+        snmp_results.update(await do_get_many(oids))
+        plan.update(oids)
 
-            if first_index is None:
-                first_index = idx
+    async def do_walk(section: str, columns: dict[str, str]) -> dict[str, dict]:
+        rows, complete = await walk_columns(
+            snmpEngine, community, target, columns, max_repetitions, caps, budget
+        )
+        if not complete:
+            incomplete.add(section)
+        return rows
 
-        # 2) Nombre de CPU base a partir del primer índice válido
-        if first_index is not None:
-            descr_oid = f"{cpu_descr_base}.{first_index}"
-            errorIndication, errorStatus, errorIndex, varBinds = await do_get(
-                descr_oid
+    async def get_cpu_info():
+        """
+        - Recorre solo hrProcessorTable; el recorrido acaba al salir de la
+          columna, tenga el equipo 1 o 200 núcleos
+        - Si el agente no deja recorrerla, sondea los índices en paralelo
+        - Guarda cada núcleo como hrProcessorLoad.<idx>
+        - Pide hrDeviceDescr solo de los índices de los núcleos
+        """
+        tables, complete = await walk_columns(
+            snmpEngine, community, target, {"load": HR_PROCESSOR_LOAD},
+            max_repetitions, caps, budget,
+        )
+        loads = {
+            idx: {"OID": vb[0].prettyPrint(), "Valor": vb[1].prettyPrint()}
+            for idx, vb in tables["load"].items()
+        }
+        if not loads:
+            loads = await probe_processor_loads(
+                snmpEngine, community, target, caps, budget
             )
+        if not loads and not complete:
+            incomplete.add("cpu")
 
-            if errorIndication:
-                snmp_results["hrDeviceDescr"] = {
-                    "OID": descr_oid,
-                    "Valor": str(errorIndication),
-                }
-            elif errorStatus:
-                snmp_results["hrDeviceDescr"] = {
-                    "OID": descr_oid,
-                    "Valor": f"Error: {errorStatus.prettyPrint()}",
-                }
-            elif varBinds:
-                vb = varBinds[0]
-                snmp_results["hrDeviceDescr"] = {
-                    "OID": vb[0].prettyPrint(),
-                    "Valor": vb[1].prettyPrint(),
-                }
-        else:
+        # 1) Recoger hrProcessorLoad.<idx>
+        for idx, entry in loads.items():
+            snmp_results[f"hrProcessorLoad.{idx}"] = entry
+            plan[f"hrProcessorLoad.{idx}"] = entry["OID"]
+
+        if not loads:
             snmp_results["hrProcessorLoad"] = {
-                "OID": cpu_load_base,
+                "OID": HR_PROCESSOR_LOAD,
                 "Valor": "CPU load not found (no valid index)",
             }
             snmp_results["hrDeviceDescr"] = {
-                "OID": cpu_descr_base,
+                "OID": HR_DEVICE_DESCR,
                 "Valor": "CPU description not found (no valid index)",
             }
+            return
 
-        # 3) Escanear varios hrDeviceDescr.* para encontrar un nombre más "CPU"
+        # 2) Nombre de CPU: hrDeviceDescr de los núcleos (mismo índice que
+        #    en hrProcessorTable), prefiriendo uno que parezca una CPU. Con
+        #    los de un solo PDU basta
+        descrs = await do_get_many({
+            str(idx): f"{HR_DEVICE_DESCR}.{idx}"
+            for idx in list(loads)[:MAX_VARBINDS_PER_PDU]
+        })
         best = None
         best_cpuish = None
 
-        for idx in range(1, 65):
-            oid = f"{cpu_descr_base}.{idx}"
-            errorIndication, errorStatus, errorIndex, varBinds = await do_get(oid)
-            if errorIndication or errorStatus or not varBinds:
-                continue
-
-            vb = varBinds[0]
-            val = vb[1].prettyPrint()
-            if any(word in val for word in ["No Such", "not found", "Error"]):
+        for entry in descrs.values():
+            if is_missing(entry) or not entry["Valor"]:
                 continue
 
             if best is None:
-                best = (vb[0].prettyPrint(), val)
+                best = entry
 
-            if re.search(r"(cpu|processor|procesador)", val, re.IGNORECASE):
-                best_cpuish = (vb[0].prettyPrint(), val)
+            if re.search(r"(cpu|processor|procesador)", entry["Valor"], re.IGNORECASE):
+                best_cpuish = entry
                 break
 
         chosen = best_cpuish or best
         if chosen:
-            oid_str, val_str = chosen
-            snmp_results["hrDeviceDescr"] = {"OID": oid_str, "Valor": val_str}
+            snmp_results["hrDeviceDescr"] = chosen
+            plan["hrDeviceDescr"] = chosen["OID"]
+        else:
+            first = next(iter(descrs.values()), None)
+            snmp_results["hrDeviceDescr"] = first or {
+                "OID": HR_DEVICE_DESCR,
+                "Valor": "CPU description not found",
+            }
 
     async def get_storage_info():
         """
         No asume que RAM / disco estén en índice .1.
-        Busca hrStorageType.<idx> para RAM y FixedDisk y llena:
+        Recorre hrStorageType para encontrar RAM y FixedDisk y llena:
         - ramStorageAllocationUnits / Size / Used / Descr
         - diskStorageAllocationUnits / Size / Used / Descr
         """
         ram_idx = None
         disk_idx = None
 
-        for idx in range(1, 65):
-            type_oid = f"1.3.6.1.2.1.25.2.3.1.2.{idx}"
-            errorIndication, errorStatus, errorIndex, varBinds = await do_get(
-                type_oid
-            )
-
-            if errorIndication or errorStatus or not varBinds:
-                continue
-
-            vb = varBinds[0]
+        types = (await do_walk("storage", {"type": HR_STORAGE_TYPE}))["type"]
+        for idx, vb in types.items():
             type_val = vb[1].prettyPrint()
 
             if type_val == HR_STORAGE_RAM and ram_idx is None:
@@ -210,38 +907,24 @@ async def get_snmp_data(ip: str, community_str: str = "public") -> dict:
             if ram_idx is not None and disk_idx is not None:
                 break
 
-        async def fill_storage(prefix: str, idx):
+        def storage_oids(prefix: str, idx) -> dict[str, str]:
             if idx is None:
-                return
+                return {}
 
             base = "1.3.6.1.2.1.25.2.3.1"
-            mapping = {
-                "AllocationUnits": f"{base}.4.{idx}",
-                "Size": f"{base}.5.{idx}",
-                "Used": f"{base}.6.{idx}",
-                "Descr": f"{base}.3.{idx}",
+            return {
+                f"{prefix}AllocationUnits": f"{base}.4.{idx}",
+                f"{prefix}Size": f"{base}.5.{idx}",
+                f"{prefix}Used": f"{base}.6.{idx}",
+                f"{prefix}Descr": f"{base}.3.{idx}",
             }
 
-            for suffix, oid in mapping.items():
-                key = f"{prefix}{suffix}"
-                errorIndication, errorStatus, errorIndex, varBinds = await do_get(oid)
-
-                if errorIndication:
-                    snmp_results[key] = {"OID": oid, "Valor": str(errorIndication)}
-                elif errorStatus:
-                    snmp_results[key] = {
-                        "OID": oid,
-                        "Valor": f"Error: {errorStatus.prettyPrint()}",
-                    }
-                elif varBinds:
-                    vb = varBinds[0]
-                    snmp_results[key] = {
-                        "OID": vb[0].prettyPrint(),
-                        "Valor": vb[1].prettyPrint(),
-                    }
-
-        await fill_storage("ramStorage", ram_idx)
-        await fill_storage("diskStorage", disk_idx)
+        # RAM y disco en un solo GET
+        oids = storage_oids("ramStorage", ram_idx)
+        oids.update(storage_oids("diskStorage", disk_idx))
+        if oids:
+            snmp_results.update(await do_get_many(oids))
+            plan.update(oids)
 
     async def get_interface_counters():
         """
@@ -254,20 +937,16 @@ async def get_snmp_data(ip: str, community_str: str = "public") -> dict:
         chosen_idx = None
         chosen_descr = None
 
-        # Probar algunos índices razonables
-        for idx in range(1, 65):
-            descr_oid = f"1.3.6.1.2.1.2.2.1.2.{idx}"  # ifDescr
-            status_oid = f"1.3.6.1.2.1.2.2.1.8.{idx}"  # ifOperStatus
-
-            err1, st1, ix1, vb1 = await do_get(descr_oid)
-            if err1 or st1 or not vb1:
-                continue
-            descr_val = vb1[0][1].prettyPrint()
+        # ifDescr + ifOperStatus de todas las interfaces en una pasada
+        tables = await do_walk("interfaces", {"descr": IF_DESCR, "status": IF_OPER_STATUS})
+        statuses = tables["status"]
 
-            err2, st2, ix2, vb2 = await do_get(status_oid)
-            if err2 or st2 or not vb2:
+        for idx, descr_vb in tables["descr"].items():
+            status_vb = statuses.get(idx)
+            if status_vb is None:
                 continue
-            status_val = vb2[0][1].prettyPrint()
+            descr_val = descr_vb[1].prettyPrint()
+            status_val = status_vb[1].prettyPrint()
 
             # 1 = up
             if status_val != "1":
@@ -290,74 +969,137 @@ async def get_snmp_data(ip: str, community_str: str = "public") -> dict:
             "OID": f"1.3.6.1.2.1.2.2.1.2.{chosen_idx}",
             "Valor": chosen_descr,
         }
+        plan[f"ifDescr.{chosen_idx}"] = f"{IF_DESCR}.{chosen_idx}"
+        # Si la interfaz deja de estar UP hay que elegir otra
+        plan[f"_ifOperStatus.{chosen_idx}"] = f"{IF_OPER_STATUS}.{chosen_idx}"
+        expect[f"_ifOperStatus.{chosen_idx}"] = "1"
 
-        # Intentar primero contadores de 64 bits
-        hc_in_oid = f"1.3.6.1.2.1.31.1.1.1.6.{chosen_idx}"   # ifHCInOctets
-        hc_out_oid = f"1.3.6.1.2.1.31.1.1.1.10.{chosen_idx}" # ifHCOutOctets
+        # Intentar primero contadores de 64 bits (IN y OUT en el mismo PDU)
+        counter_oids = {
+            "in": f"1.3.6.1.2.1.31.1.1.1.6.{chosen_idx}",    # ifHCInOctets
+            "out": f"1.3.6.1.2.1.31.1.1.1.10.{chosen_idx}",  # ifHCOutOctets
+        }
+        fallback_oids = {
+            "in": f"1.3.6.1.2.1.2.2.1.10.{chosen_idx}",   # ifInOctets
+            "out": f"1.3.6.1.2.1.2.2.1.16.{chosen_idx}",  # ifOutOctets
+        }
 
         def is_valid_counter(val: str) -> bool:
             return val.isdigit()
 
-        # IN
-        err_in, st_in, ix_in, vb_in = await do_get(hc_in_oid)
-        if (
-            not err_in
-            and not st_in
-            and vb_in
-            and is_valid_counter(vb_in[0][1].prettyPrint())
+        # Si ya sabemos que no tiene contadores de 64 bits no se preguntan
+        counters = {}
+        if caps.get("hc_counters", True):
+            counters = await do_get_many(counter_oids)
+        valid = {
+            key: oid
+            for key, oid in counter_oids.items()
+            if key in counters and is_valid_counter(counters[key]["Valor"])
+        }
+        if counters and all(
+            is_missing(counters.get(key)) or key in valid for key in counter_oids
         ):
-            in_oid = hc_in_oid
-            in_val = vb_in[0][1].prettyPrint()
-        else:
-            in_oid_32 = f"1.3.6.1.2.1.2.2.1.10.{chosen_idx}"  # ifInOctets
-            err_in2, st_in2, ix_in2, vb_in2 = await do_get(in_oid_32)
-            if err_in2 or st_in2 or not vb_in2:
-                in_oid = in_oid_32
-                in_val = "0"
-            else:
-                in_oid = in_oid_32
-                in_val = vb_in2[0][1].prettyPrint()
-
-        snmp_results[f"ifInOctets.{chosen_idx}"] = {
-            "OID": in_oid,
-            "Valor": in_val,
+            caps["hc_counters"] = len(valid) == len(counter_oids)
+        missing = {
+            key: oid
+            for key, oid in fallback_oids.items()
+            if key not in counters or not is_valid_counter(counters[key]["Valor"])
         }
 
-        # OUT
-        err_out, st_out, ix_out, vb_out = await do_get(hc_out_oid)
-        if (
-            not err_out
-            and not st_out
-            and vb_out
-            and is_valid_counter(vb_out[0][1].prettyPrint())
-        ):
-            out_oid = hc_out_oid
-            out_val = vb_out[0][1].prettyPrint()
-        else:
-            out_oid_32 = f"1.3.6.1.2.1.2.2.1.16.{chosen_idx}"  # ifOutOctets
-            err_out2, st_out2, ix_out2, vb_out2 = await do_get(out_oid_32)
-            if err_out2 or st_out2 or not vb_out2:
-                out_oid = out_oid_32
-                out_val = "0"
-            else:
-                out_oid = out_oid_32
-                out_val = vb_out2[0][1].prettyPrint()
+        # Contadores de 32 bits solo para los que fallaron
+        if missing:
+            counters_32 = await do_get_many(missing)
+            for key, oid in missing.items():
+                entry = counters_32.get(key)
+                if entry is not None and is_valid_counter(entry["Valor"]):
+                    valid[key] = oid
+                    counters[key] = {"OID": oid, "Valor": entry["Valor"]}
+                    continue
+                # Sin contador no se inventa un 0: se deja el timeout (y la
+                # sección queda incompleta) o lo que contestó el agente
+                timed_out = [e for e in (entry, counters.get(key)) if is_timeout(e)]
+                if timed_out:
+                    incomplete.add("interfaces")
+                    counters[key] = timed_out[0]
+                else:
+                    counters[key] = entry or {"OID": oid, "Valor": "Counter not found"}
 
-        snmp_results[f"ifOutOctets.{chosen_idx}"] = {
-            "OID": out_oid,
-            "Valor": out_val,
+        snmp_results[f"ifInOctets.{chosen_idx}"] = counters["in"]
+        snmp_results[f"ifOutOctets.{chosen_idx}"] = counters["out"]
+        for key, oid in valid.items():
+            plan[f"if{key.capitalize()}Octets.{chosen_idx}"] = oid
+
+    # Lanzar todo en paralelo; lo que no acabe en plazo se cancela
+    tasks = {
+        asyncio.ensure_future(get_scalars()): "scalars",
+        asyncio.ensure_future(get_cpu_info()): "cpu",
+        asyncio.ensure_future(get_storage_info()): "storage",
+        asyncio.ensure_future(get_interface_counters()): "interfaces",
+    }
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=max(budget.time_left(), 0))
+    finally:
+        for task in tasks:
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if task.exception() is not None:
+            raise task.exception()
+    finished = {tasks[task] for task in done} - incomplete
+
+    # Solo se cachea una estructura descubierta entera y con el agente respondiendo
+    if (
+        not incomplete
+        and not pending
+        and snmp_results.get("_sysUpTime", {}).get("Valor", "").isdigit()
+    ):
+        required = [
+            key for key in plan
+            if key not in SCALAR_OIDS and not key.startswith("_")
+        ]
+        static = {
+            key: entry for key, entry in snmp_results.items() if key not in plan
         }
+        layout_cache.put(ip, plan, static, snmp_results, required, expect)
+
+    remember_caps(snmp_results)
+    return public_results(snmp_results), poll_sections(snmp_results, finished)
+
 
-    # Lanzar todo en paralelo
-    tasks = [get_scalar(name, oid) for name, oid in SCALAR_OIDS.items()]
-    tasks.append(get_cpu_info())
-    tasks.append(get_storage_info())
-    tasks.append(get_interface_counters())
+def section_of(key: str) -> str:
+    """Sección (recolector) a la que pertenece una clave del resultado."""
+    if key.startswith(("hrProcessorLoad", "hrDeviceDescr")):
+        return "cpu"
+    if key.startswith(("ramStorage", "diskStorage")):
+        return "storage"
+    if key.startswith(("if", "_if")):
+        return "interfaces"
+    return "scalars"
 
-    await asyncio.gather(*tasks)
-    snmpEngine.close_dispatcher()
 
-    return snmp_results
+def poll_sections(
+    snmp_results: dict[str, dict], finished: set[str] | None = None
+) -> dict[str, dict]:
+    """
+    {sección: {'complete': bool}}. Una sección está completa si su
+    recolector terminó (`finished`; todas si es None) y ninguna de sus
+    entradas se quedó sin respuesta.
+    """
+    sections = {
+        name: {"complete": finished is None or name in finished}
+        for name in POLL_SECTIONS
+    }
+    for key, entry in snmp_results.items():
+        if is_timeout(entry):
+            sections[section_of(key)]["complete"] = False
+    return sections
+
+
+def public_results(snmp_results: dict[str, dict]) -> dict[str, dict]:
+    # Las claves con "_" son internas (uptime del agente, ifOperStatus...)
+    return {
+        key: entry for key, entry in snmp_results.items() if not key.startswith("_")
+    }
 
 
 def export_to_xml(data: dict) -> str:
@@ -13,7 +13,7 @@ function AddDevice({ onClose }) {
     return regex.test(ip);
   };
 
-  const handleSubmit = (e) => {
+  const handleSubmit = async (e) => {
     e.preventDefault();
 
     setErrorApodo("");
@@ -37,25 +37,26 @@ function AddDevice({ onClose }) {
 
     if (!valid) return;
 
-    let devices = [];
-    const stored = localStorage.getItem("devices");
-    if (stored) {
-      try {
-        devices = JSON.parse(stored) || [];
-      } catch {
-        devices = [];
+    // El inventario vive en el backend para que pueda sondear en segundo plano
+    try {
+      const response = await fetch("http://127.0.0.1:8000/api/devices", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ ip: trimmedIp, alias: apodo.trim() }),
+      });
+
+      // Evitar IP duplicadas
+      if (response.status === 409) {
+        setErrorIp("Ya existe un dispositivo con esa IP");
+        return;
       }
-    }
-
-    // Evitar IP duplicadas
-    if (devices.some((d) => d.ip === trimmedIp)) {
-      setErrorIp("Ya existe un dispositivo con esa IP");
+      if (!response.ok) throw new Error("Error en la respuesta");
+    } catch (err) {
+      console.error("Error al guardar el dispositivo:", err);
+      setErrorIp("No se pudo guardar el dispositivo en el servidor");
       return;
     }
 
-    devices.push({ ip: trimmedIp, apodo: apodo.trim() });
-    localStorage.setItem("devices", JSON.stringify(devices));
-
     setApodo("");
     setIp("");
 
@@ -50,27 +50,22 @@ function TableOID({ device }) {
   useEffect(() => {
     if (!ip) return;
 
-    let intervalId;
-
-    async function obtenerDatosJSON() {
+    let socket;
+    let reconnectId;
+    let closed = false;
+    // Datos completos del dispositivo; el servidor solo envía lo que cambia
+    let data = {};
+    let lastSampleMs = null;
+
+    function procesarDatos(sampleMs) {
       try {
-        setIsLoading(true);
-
-        const response = await fetch(
-          `http://127.0.0.1:8000/api/snmp?ip=${ip}&format=json`,
-          {
-            headers: { Accept: "application/json" },
-          }
-        );
-        if (!response.ok) throw new Error("Error en la respuesta");
-
-        const result = await response.json();
-        const data = result.Data || result;
-
-        setRaw(data);
+        setRaw({ ...data });
         setError(null);
 
-        const timestamp = new Date().toLocaleTimeString();
+        const timestamp = new Date(sampleMs).toLocaleTimeString();
+        const deltaSeconds =
+          lastSampleMs != null ? (sampleMs - lastSampleMs) / 1000 : null;
+        lastSampleMs = sampleMs;
 
         // ========= METADATA =========
         const os = data?.sysDescr?.Valor || null;
@@ -178,10 +173,9 @@ function TableOID({ device }) {
         let diskActivityMBps = null;
         if (diskUsed != null && diskAlloc != null) {
           const lastUsed = lastDiskUsedRef.current;
-          if (lastUsed != null && diskUsed >= lastUsed) {
+          if (lastUsed != null && diskUsed >= lastUsed && deltaSeconds > 0) {
             const deltaBlocks = diskUsed - lastUsed;
             const deltaBytes = deltaBlocks * diskAlloc;
-            const deltaSeconds = INTERVALO_MS / 1000;
             const bytesPerSec = deltaBytes / deltaSeconds;
             diskActivityMBps = bytesPerSec / (1024 * 1024); // MB/s
           }
@@ -206,9 +200,8 @@ function TableOID({ device }) {
           const totalOctets = inOctets + outOctets;
           const last = lastNetOctetsRef.current;
 
-          if (last != null && totalOctets >= last) {
+          if (last != null && totalOctets >= last && deltaSeconds > 0) {
             const deltaOctets = totalOctets - last;
-            const deltaSeconds = INTERVALO_MS / 1000;
 
             const bytesPerSec = deltaOctets / deltaSeconds;
             netMbps = (bytesPerSec * 8) / 1_000_000; // bits/s → Mbps
@@ -231,10 +224,63 @@ function TableOID({ device }) {
           net: pushPoint(prev.net, netMbps),
         }));
       } catch (err) {
-        console.error("Error al obtener datos JSON:", err);
+        console.error("Error al procesar datos SNMP:", err);
         setError(err.message);
-      } finally {
+      }
+    }
+
+    // Un único sondeo en el servidor para todos los que miran este
+    // dispositivo; cada mensaje trae solo las claves que cambiaron
+    function conectar() {
+      setIsLoading(true);
+      socket = new WebSocket(
+        `ws://127.0.0.1:8000/ws/devices/${ip}?interval=${INTERVALO_MS / 1000}`
+      );
+
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        data = message.Full ? { ...message.Changed } : { ...data, ...message.Changed };
+        for (const key of message.Removed || []) delete data[key];
         setIsLoading(false);
+        procesarDatos(Date.parse(message.Timestamp));
+      };
+
+      socket.onerror = () => setError("Error en la conexión con el servidor");
+
+      socket.onclose = () => {
+        if (closed) return;
+        // Reconectar; el servidor vuelve a enviar los datos completos
+        reconnectId = setTimeout(conectar, INTERVALO_MS);
+      };
+    }
+
+    // Últimos puntos guardados en el servidor, para no empezar en blanco
+    async function cargarHistorico() {
+      const desde = Date.now() / 1000 - (MAX_POINTS * INTERVALO_MS) / 1000;
+      try {
+        const series = await Promise.all(
+          ["cpu", "ram"].map(async (metric) => {
+            const response = await fetch(
+              `http://127.0.0.1:8000/api/devices/${ip}/history?metric=${metric}&from=${desde}&points=${MAX_POINTS}`
+            );
+            if (!response.ok) return [];
+            const result = await response.json();
+            return result.points
+              .filter(([t]) => lastSampleMs == null || t * 1000 < lastSampleMs)
+              .map(([t, value]) => ({
+                time: new Date(t * 1000).toLocaleTimeString(),
+                value,
+              }));
+          })
+        );
+        if (closed) return;
+        setHistory((prev) => ({
+          ...prev,
+          cpu: [...series[0], ...prev.cpu].slice(-MAX_POINTS),
+          ram: [...series[1], ...prev.ram].slice(-MAX_POINTS),
+        }));
+      } catch (err) {
+        console.error("Error al cargar el histórico:", err);
       }
     }
 
@@ -243,10 +289,14 @@ function TableOID({ device }) {
     lastNetOctetsRef.current = null;
     lastDiskUsedRef.current = null;
 
-    obtenerDatosJSON();
-    intervalId = setInterval(obtenerDatosJSON, INTERVALO_MS);
+    cargarHistorico();
+    conectar();
 
-    return () => clearInterval(intervalId);
+    return () => {
+      closed = true;
+      clearTimeout(reconnectId);
+      socket?.close();
+    };
   }, [ip]);
 
   const latest = useMemo(() => {
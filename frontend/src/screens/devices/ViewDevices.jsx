@@ -5,20 +5,36 @@ function ViewDevices({ onMonitor, onAddDeviceClick }) {
   const [devices, setDevices] = useState([]);
 
   useEffect(() => {
-    const stored = localStorage.getItem("devices");
-    if (stored) {
+    async function obtenerDispositivos() {
       try {
-        setDevices(JSON.parse(stored));
-      } catch {
+        const response = await fetch("http://127.0.0.1:8000/api/devices");
+        if (!response.ok) throw new Error("Error en la respuesta");
+        const result = await response.json();
+        setDevices(
+          (result.devices || []).map((d) => ({ ip: d.ip, apodo: d.alias }))
+        );
+      } catch (err) {
+        console.error("Error al obtener dispositivos:", err);
         setDevices([]);
       }
     }
+
+    obtenerDispositivos();
   }, []);
 
-  const handleDelete = (ipToDelete) => {
-    const filtered = devices.filter((device) => device.ip !== ipToDelete);
-    setDevices(filtered);
-    localStorage.setItem("devices", JSON.stringify(filtered));
+  const handleDelete = async (ipToDelete) => {
+    try {
+      const response = await fetch(
+        `http://127.0.0.1:8000/api/devices/${ipToDelete}`,
+        { method: "DELETE" }
+      );
+      if (!response.ok && response.status !== 404) {
+        throw new Error("Error en la respuesta");
+      }
+      setDevices(devices.filter((device) => device.ip !== ipToDelete));
+    } catch (err) {
+      console.error("Error al eliminar el dispositivo:", err);
+    }
   };
 
   return (